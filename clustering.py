@@ -1,6 +1,11 @@
 """As from https://www.section.io/engineering-education/hierarchical-clustering-in-python/"""
 
 # IMPORTS
+import logging
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, \
+    ThreadPoolExecutor
+
 import numpy as np # to handle numeric data
 import matplotlib.pyplot as plt # for visualization
 import pandas as pd # for handling dataframe
@@ -8,14 +13,24 @@ import pandas as pd # for handling dataframe
 from sklearn.cluster import DBSCAN # Density-Based Spatial Clustering of Applications with Noise
 from sklearn.cluster import AgglomerativeClustering
 import scipy.cluster.hierarchy as sch # importing scipy.cluster.hierarchy for dendrogram
+from scipy import ndimage # connected components of frontier points
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+
+# Frontier points are labelled on a grid when their bounding box has at most
+# this many cells per point, and through their adjacency graph otherwise.
+DENSE_LABEL_CELLS_PER_POINT = 64
+
+CLUSTERING_DEFAULTS = {"AGNES": {"type": 'hierarchical', "metric": 10, "n_clusters": 5, "linkage": 'ward', "dendrogram": None},
+                       "DIANA": {"type": 'hierarchical', "metric": 10, "n_clusters": 5, "linkage": 'ward', "dendrogram": None},
+                       "DBSCAN": {"type": 'density', "metric": 3.5},
+                       "CC": {"type": 'component', "metric": None, "n_clusters": 5}
+                       }
 
-def frontier_clustering(data, step, data_form="map", algo="AGNES", metric=None, save_freq=None):
+def frontier_clustering(data, step, data_form="map", algo="AGNES", metric=None, save_freq=None, out=None):
 
     # initialization
-    defaults = {"AGNES": {"type": 'hierarchical', "metric": 10, "n_clusters": 5, "linkage": 'ward', "dendrogram": None},
-                "DIANA": {"type": 'hierarchical', "metric": 10, "n_clusters": 5, "linkage": 'ward', "dendrogram": None},
-                "DBSCAN": {"type": 'density', "metric": 3.5}
-                }
+    defaults = CLUSTERING_DEFAULTS
     assert algo in defaults.keys()
     if not metric:
         metric = defaults[algo]["metric"]
@@ -24,8 +39,11 @@ def frontier_clustering(data, step, data_form="map", algo="AGNES", metric=None,
     if algo_type == 'hierarchical':
         algo_info = defaults[algo]
         n_clusters, linkage, dendrogram = algo_info["n_clusters"], algo_info["linkage"], algo_info["dendrogram"]
+    elif algo_type == 'component':
+        n_clusters = defaults[algo]["n_clusters"]
 
-    # clustering
+    # clustering (CC is near-linear in the number of points, AGNES needs
+    # quadratic time and memory)
     if algo == "DBSCAN":
         clusters = DBSCAN(eps=metric)
     elif algo == "AGNES":
@@ -38,7 +56,10 @@ def frontier_clustering(data, step, data_form="map", algo="AGNES", metric=None,
         num_rows = num_cols = np.amax(data)
 
     #print(f"DATA_MID_SHAPE: {data.shape}")
-    y_hc = clusters.fit_predict(data)  # model fitting on the dataset
+    if algo == "CC":
+        y_hc = component_clustering(data, n_clusters)
+    else:
+        y_hc = clusters.fit_predict(data)  # model fitting on the dataset
     #print(f"DATA_CLUSTERING_SHAPE: {y_hc}")
     if y_hc.shape[0] == 0:
         save_freq = 1
@@ -46,7 +67,7 @@ def frontier_clustering(data, step, data_form="map", algo="AGNES", metric=None,
     # calculating cluster means
     means_col = get_frontier_cluster_region_means(data, y_hc, n_clusters)
     #print(means_col)
-    means_map = columns_to_map(means_col, num_rows, num_cols)
+    means_map = columns_to_map(means_col, num_rows, num_cols, out=out)
 	
     #print(f"DATA_OUT_SHAPE: {means_map.shape}")
     #print(f"MEANS_MAP: {np.amax(means_map)}")
@@ -65,34 +86,379 @@ def frontier_clustering(data, step, data_form="map", algo="AGNES", metric=None,
     return means_map
 
 
-def map_to_columns(data, num_rows):
-    nzero_is = np.nonzero(data)
-    nzero_is_sw = np.transpose(nzero_is)
-    columns = np.flip(nzero_is_sw, axis=1)
-    slice = columns[:,1]
-    convert_slice = [(-1*x)-1+num_rows for x in slice]
-    columns[:,1] = convert_slice
+class FrontierClusterCache(object):
+    """
+    Frontier clustering for one env that keeps the last labelling between
+    steps. When less than recluster_threshold of the frontier points were
+    added or removed since the last full clustering, removed points leave
+    their clusters and new points join the cluster with the nearest
+    centroid. Otherwise, or if a cluster empties, or after reset(), all
+    points are clustered again with algo. This keeps the cluster means
+    stable from one step to the next. With the default threshold of 0,
+    every change is clustered again and only an unchanged frontier reuses
+    the last result, as frontier_clustering would return it.
+    """
+
+    def __init__(self, algo="AGNES", recluster_threshold=0.):
+        assert algo in ("CC", "AGNES")
+        self.algo = algo
+        self.n_clusters = CLUSTERING_DEFAULTS[algo]["n_clusters"]
+        self.recluster_threshold = recluster_threshold
+        self.reset()
+
+    def reset(self):
+        self.shape = None
+        self.points = None  # sorted flat indices of the frontier points
+        self.labels = None
+        self.means_map = None
+        self.num_changed = 0  # points changed since the last full clustering
+
+    def cluster(self, frontier_map, points=None):
+        """Returns the means_map of frontier_clustering for frontier_map.
+        points, the sorted flat indices of its non-zero cells, can be given
+        when they are already known. The returned map is reused by the next
+        call."""
+        if points is None:
+            points = np.flatnonzero(frontier_map)
+        return self.cluster_points(points, frontier_map.shape)
+
+    def cluster_points(self, points, shape):
+        """Same as cluster, for a frontier given by the sorted flat indices
+        of its cells in a map of the given shape. The (x, y) columns of the
+        means are left in self.means_col."""
+        shape = tuple(shape)
+        if self.points is not None and self.shape == shape and \
+                np.array_equal(points, self.points):
+            return self.means_map
+
+        if self.points is None or self.shape != shape or \
+                not self._update(points):
+            self._recluster(points, shape)
+
+        # Only the cells of the previous means are cleared in the reused map
+        means_col = np.round(self.sums / self.counts[:, None]).astype(np.int64)
+        self.means_col = means_col
+        if self.means_map is None or self.means_map.shape != self.shape:
+            self.means_map = np.zeros(self.shape)
+        else:
+            self.means_map[self.means_cells] = 0.
+        self.means_cells = (self.shape[0] - 1 - means_col[:, 1], means_col[:, 0])
+        self.means_map[self.means_cells] = 1.
+        return self.means_map
+
+    def _columns(self, points):
+        # Same (x, y) convention as map_to_columns
+        rows, cols = np.divmod(points, self.shape[1])
+        return np.stack([cols, self.shape[0] - 1 - rows], axis=1)
+
+    def _recluster(self, points, shape):
+        self.shape = shape
+        self.points = points
+        data = self._columns(points)
+        if self.algo == "CC":
+            self.labels = component_clustering(data, self.n_clusters)
+        else:
+            self.labels = AgglomerativeClustering(
+                n_clusters=self.n_clusters, affinity='euclidean',
+                linkage=CLUSTERING_DEFAULTS[self.algo]["linkage"]
+            ).fit_predict(data)
+        num_labels = self.labels.max() + 1
+        self.counts = np.bincount(self.labels, minlength=num_labels)
+        self.sums = np.stack([np.bincount(self.labels, data[:, i], num_labels)
+                              for i in range(2)], axis=1)
+        self.num_changed = 0
+
+    def _update(self, points):
+        # Returns False if the frontier changed too much to update in place
+        kept = np.isin(self.points, points, assume_unique=True)
+        added = points[~np.isin(points, self.points, assume_unique=True)]
+        self.num_changed += np.count_nonzero(~kept) + len(added)
+        if self.num_changed > self.recluster_threshold * len(points):
+            return False
+
+        num_labels = len(self.counts)
+        removed = self._columns(self.points[~kept])
+        removed_labels = self.labels[~kept]
+        counts = self.counts - np.bincount(removed_labels, minlength=num_labels)
+        if (counts == 0).any():
+            return False
+        sums = self.sums - np.stack([
+            np.bincount(removed_labels, removed[:, i], num_labels)
+            for i in range(2)], axis=1)
+
+        new = self._columns(added)
+        centroids = sums / counts[:, None]
+        new_labels = ((new[:, None, :] - centroids[None, :, :]) ** 2
+                      ).sum(2).argmin(1)
+        self.counts = counts + np.bincount(new_labels, minlength=num_labels)
+        self.sums = sums + np.stack([
+            np.bincount(new_labels, new[:, i], num_labels) for i in range(2)],
+            axis=1)
+
+        all_points = np.concatenate([self.points[kept], added])
+        order = np.argsort(all_points, kind='stable')
+        self.points = all_points[order]
+        self.labels = np.concatenate([self.labels[kept], new_labels])[order]
+        return True
+
+
+def _cluster_snapshot(algo, points, shape):
+    # Runs in a worker process, so nothing is kept between snapshots
+    cache = FrontierClusterCache(algo)
+    cache.cluster_points(points, shape)
+    return cache.means_col
+
+
+class AsyncFrontierClustering(object):
+    """
+    Clusters frontier snapshots on a thread or process pool, so that callers
+    do not wait for the clustering. Snapshots are submitted per key (e.g.
+    the env index) with the step they were taken at, and get() returns the
+    latest completed means_map with its step. Each key has at most one job
+    running: a snapshot submitted meanwhile waits for it, replacing any
+    older waiting snapshot. Thread workers keep a FrontierClusterCache per
+    key, process workers cluster each snapshot from scratch. A job that
+    fails is logged and its snapshot clustered again synchronously, from
+    scratch. close() shuts the pool down.
+    """
+
+    def __init__(self, algo="AGNES", recluster_threshold=0., num_workers=1,
+                 use_processes=False):
+        self.algo = algo
+        self.recluster_threshold = recluster_threshold
+        self.use_processes = use_processes
+        executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+        self.pool = executor(max_workers=num_workers)
+        self.lock = threading.Condition()
+        self.caches = {}
+        self.running = {}  # key -> reset count of the running job
+        self.waiting = {}  # key -> (step, points, shape)
+        self.results = {}  # key -> (step, means_col, shape)
+        self.means_maps = {}
+        self.resets = {}
+
+    def submit(self, key, frontier_map, step, points=None):
+        """Queues frontier_map, or its sorted flat non-zero indices points,
+        to be clustered for key. The map is not referenced after the call."""
+        points = np.flatnonzero(frontier_map) if points is None \
+            else np.array(points)
+        snapshot = (step, points, tuple(np.shape(frontier_map)))
+        with self.lock:
+            if key in self.running:
+                self.waiting[key] = snapshot
+            else:
+                self._start(key, snapshot)
+
+    def get(self, key):
+        """Returns (step, means_map) of the latest completed snapshot of
+        key, or (None, None) if there is none yet. The map is reused for
+        the next result of the same key."""
+        with self.lock:
+            if key not in self.results:
+                return None, None
+            step, means_col, shape = self.results[key]
+            means_map = self.means_maps.get(key)
+            if means_map is None or means_map.shape != shape:
+                means_map = self.means_maps[key] = np.zeros(shape)
+            return step, columns_to_map(means_col, shape[0], shape[1],
+                                        out=means_map)
+
+    def reset(self, key):
+        """Drops the results and waiting snapshot of key, e.g. on episode
+        reset. A job still running for key is discarded when it ends."""
+        with self.lock:
+            self.resets[key] = self.resets.get(key, 0) + 1
+            self.results.pop(key, None)
+            self.waiting.pop(key, None)
+            # A running job may still be using the old cache
+            self.caches.pop(key, None)
+
+    def wait(self):
+        """Blocks until every submitted snapshot has been clustered."""
+        with self.lock:
+            self.lock.wait_for(lambda: not self.running)
+
+    def close(self):
+        """Waits for the running jobs and shuts the pool down."""
+        self.pool.shutdown(wait=True)
+
+    def _start(self, key, snapshot):
+        step, points, shape = snapshot
+        self.running[key] = self.resets.get(key, 0)
+        try:
+            if self.use_processes:
+                future = self.pool.submit(_cluster_snapshot, self.algo,
+                                          points, shape)
+            else:
+                if key not in self.caches:
+                    self.caches[key] = FrontierClusterCache(
+                        self.algo, self.recluster_threshold)
+                future = self.pool.submit(self._cluster, self.caches[key],
+                                          points, shape)
+        except RuntimeError as error:
+            # Broken or shut down pool, handled by _done like a failed job
+            future = Future()
+            future.set_exception(error)
+        future.add_done_callback(
+            lambda future: self._done(key, snapshot, future))
+
+    @staticmethod
+    def _cluster(cache, points, shape):
+        cache.cluster_points(points, shape)
+        return cache.means_col.copy()
+
+    def _done(self, key, snapshot, future):
+        step, points, shape = snapshot
+        with self.lock:
+            try:
+                if self.running.pop(key) == self.resets.get(key, 0):
+                    try:
+                        means_col = future.result()
+                    except Exception:
+                        # e.g. a broken process pool, the cache of key may
+                        # be half updated
+                        logging.exception(
+                            "Frontier clustering of key {} at step {} failed,"
+                            " clustering it synchronously".format(key, step))
+                        self.caches.pop(key, None)
+                        means_col = self._cluster(FrontierClusterCache(
+                            self.algo, self.recluster_threshold),
+                            points, shape)
+                    self.results[key] = (step, means_col, shape)
+            finally:
+                if key in self.waiting:
+                    self._start(key, self.waiting.pop(key))
+                self.lock.notify_all()
+
+
+def component_clustering(data, n_clusters, max_iter=10):
+    """Clusters frontier points (columns of integer x, y) into n_clusters
+    groups in near-linear time and returns their labels, like fit_predict.
+
+    Frontier points are first grouped into 8-connected components. Extra
+    components are merged by a size-weighted k-means on their centroids,
+    seeded with the largest ones. If there are too few, the largest
+    cluster is split in two across its principal axis until there are
+    n_clusters.
+    """
+    num_points = data.shape[0]
+    if num_points == 0:
+        return np.zeros((0,), dtype=np.int64)
+    n_clusters = min(n_clusters, num_points)
+
+    labels, num_components = frontier_components(data)
+
+    if num_components > n_clusters:
+        sizes = np.bincount(labels, minlength=num_components).astype(float)
+        centroids = np.stack([
+            np.bincount(labels, data[:, i], num_components) for i in range(2)],
+            axis=1) / sizes[:, None]
+        centers = centroids[np.argsort(-sizes, kind='stable')[:n_clusters]]
+        for _ in range(max_iter):
+            dists = ((centroids[:, None, :] - centers[None, :, :]) ** 2).sum(2)
+            assignment = dists.argmin(1)
+            weights = np.bincount(assignment, sizes, n_clusters)
+            new_centers = centers.copy()
+            nonempty = weights > 0
+            for i in range(2):
+                new_centers[nonempty, i] = np.bincount(
+                    assignment, sizes * centroids[:, i],
+                    n_clusters)[nonempty] / weights[nonempty]
+            if np.array_equal(new_centers, centers):
+                break
+            centers = new_centers
+        labels = assignment[labels]
+        # Clusters that ended up empty are dropped from the label range
+        _, labels = np.unique(labels, return_inverse=True)
+
+    num_labels = labels.max() + 1
+    while num_labels < n_clusters:
+        sizes = np.bincount(labels, minlength=num_labels)
+        members = np.flatnonzero(labels == sizes.argmax())
+        points = data[members].astype(float)
+        points -= points.mean(0)
+        _, vectors = np.linalg.eigh(points.T.dot(points))
+        order = np.argsort(points.dot(vectors[:, -1]), kind='stable')
+        labels[members[order[len(order) // 2:]]] = num_labels
+        num_labels += 1
+
+    return labels
+
+
+def frontier_components(data):
+    """Labels the 8-connected components of frontier points (columns of
+    integer x, y). Points with a compact bounding box are rasterized and
+    labelled on the grid, sparse ones through their adjacency graph, so the
+    cost stays near-linear in the number of points."""
+    low = data.min(0)
+    high = data.max(0)
+    shape = high - low + 1
+    if shape[0] * shape[1] <= DENSE_LABEL_CELLS_PER_POINT * len(data):
+        grid = np.zeros(shape, dtype=bool)
+        grid[data[:, 0] - low[0], data[:, 1] - low[1]] = True
+        components, num_components = ndimage.label(
+            grid, structure=np.ones((3, 3)))
+        return components[data[:, 0] - low[0], data[:, 1] - low[1]] - 1, \
+            num_components
+
+    # Flat indices with a one cell border, so that neighbours never wrap
+    width = int(shape[1]) + 2
+    flat = (data[:, 0] - low[0] + 1).astype(np.int64) * width + \
+        data[:, 1] - low[1] + 1
+    order = np.argsort(flat)
+    sorted_flat = flat[order]
+
+    offsets = np.array([1, width - 1, width, width + 1])
+    queries = (flat[None, :] + offsets[:, None]).ravel()
+    index = np.searchsorted(sorted_flat, queries)
+    index[index == len(flat)] = 0
+    found = sorted_flat[index] == queries
+    rows = np.flatnonzero(found) % len(flat)
+    cols = order[index[found]]
+    adjacency = coo_matrix((np.ones(len(rows), dtype=bool), (rows, cols)),
+                           shape=(len(flat), len(flat)))
+    num_components, labels = connected_components(adjacency, directed=False)
+    return labels, num_components
+
+
+def map_to_columns(data, num_rows, out=None):
+    # (x, y) columns of the non-zero cells, x = col and y = num_rows-1-row.
+    # out, if given, is an int array of at least num_points x 2 that is
+    # reused, and a view of its first rows is returned.
+    rows, cols = np.nonzero(data)
+    if out is None:
+        columns = np.empty((len(rows), 2), dtype=np.int64)
+    else:
+        columns = out[:len(rows)]
+    columns[:, 0] = cols
+    np.subtract(num_rows - 1, rows, out=columns[:, 1])
     return columns
 
-def columns_to_map(data, r, c):
-    map_out = np.zeros([r, c])
-    for i, row in enumerate(data):
-        map_out[r-1-int(row[1]), int(row[0])] = 1.
+def columns_to_map(data, r, c, out=None):
+    # out, if given, is a r x c map that is cleared and reused
+    if out is None:
+        map_out = np.zeros([r, c])
+    else:
+        map_out = out
+        map_out.fill(0.)
+    data = np.asarray(data).astype(np.int64)
+    map_out[r-1-data[:, 1], data[:, 0]] = 1.
     return map_out
 
-def get_frontier_cluster_region_means(data, y_hc, n_clusters):
+def get_frontier_cluster_region_means(data, y_hc, n_clusters, out=None):
 
-    # full_map = torch.zeros(num_scenes, 5, full_w, full_h).float().to(device)
-    # newData = ourData.iloc[:, [6, 7]].values # extract the two features from our dataset (for plots)
-    # for each cluster, return the coordinates of the mean of all frontier coordinates in that cluster
-    column = np.zeros([n_clusters, 2])
-    for clstr in range(n_clusters):
-        cluster_coords_x, cluster_coords_y = data[y_hc == clstr, 0], data[y_hc == clstr, 1]
-        cluster_mean_x, cluster_mean_y = np.mean(cluster_coords_x), np.mean(cluster_coords_y)
-        cluster_mean_x, cluster_mean_y = int(round(cluster_mean_x,0)), int(round(cluster_mean_y,0))
-        column[clstr][0], column[clstr][1] = cluster_mean_x, cluster_mean_y
+    # for each cluster, return the coordinates of the mean of all frontier
+    # coordinates in that cluster, rounded to the nearest cell. Empty
+    # clusters have no mean and are left out.
+    counts = np.bincount(y_hc, minlength=n_clusters)[:n_clusters]
+    column = np.zeros([n_clusters, 2]) if out is None else out
+    for i in range(2):
+        column[:, i] = np.bincount(y_hc, data[:, i], n_clusters)[:n_clusters]
+    nonempty = counts > 0
+    column[nonempty] /= counts[nonempty, None]
+    np.round(column, out=column)
 
-    return column
+    return column if nonempty.all() else column[nonempty]
 
 # plotting dendrogram, also allows finding the optimal number of clusters
 def hierarchical_dendrogram(data, linkage, dendro_save_path):
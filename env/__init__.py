@@ -56,6 +56,15 @@ class VecPyTorch():
         stg = torch.from_numpy(stg).float()
         return stg
 
+    def get_short_term_goal_batch(self, inputs):
+        # Plans for the envs whose input is not None in a single round trip,
+        # the other envs only receive {'active': False}. None if no env plans
+        if all(p_input is None for p_input in inputs):
+            return None
+        inputs = [{'active': False} if p_input is None else
+                  dict(p_input, active=True) for p_input in inputs]
+        return self.get_short_term_goal(inputs)
+
     def update_visualize(self,option):
         self.venv.update_visualize(option)
 
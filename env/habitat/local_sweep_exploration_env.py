@@ -31,12 +31,18 @@ import habitat
 from habitat import logger
 
 from env.utils.map_builder import MapBuilder
-from env.utils.fmm_planner import FMMPlanner
+from env.utils.fmm_planner import FMMDistanceCache, FMMPlanner, \
+    get_geodesic_distance, get_reachable_goal
+from env.utils.frontier import FrontierSegments, rank_frontier_clusters
+from env.utils.map_state import COUNT_DTYPE, PackedMap
+from env.utils.obstacle_map import InflatedObstacleMap
+from env.utils.planners import get_planner
 
 from env.habitat.utils.noisy_actions import CustomActionSpaceConfiguration
 
 from env.habitat.utils import pose as pu
 from env.habitat.utils import visualizations as vu
+from env.habitat.utils.depth import DepthPreprocessor
 
 
 from env.habitat.utils.supervision import HabitatMaps
@@ -48,20 +54,6 @@ from model import get_grid
 timer = TicToc()
 
 
-def _preprocess_depth(depth):
-    depth = depth[:, :, 0]*1
-    mask2 = depth > 0.99
-    depth[mask2] = 0.
-
-    for i in range(depth.shape[1]):
-        depth[:,i][depth[:,i] == 0.] = depth[:,i].max()
-
-    mask1 = depth == 0
-    depth[mask1] = np.NaN
-    depth = depth*1000.
-    return depth
-
-
 class Exploration_Env(habitat.RLEnv):
 
     def __init__(self, args, rank, config_env, config_baseline, dataset):
@@ -111,6 +103,8 @@ class Exploration_Env(habitat.RLEnv):
                                                 dtype='uint8')
 
         self.mapper = self.build_mapper()
+        self.preprocess_depth = DepthPreprocessor(args.env_frame_height,
+                                                  args.env_frame_width)
 
         self.episode_no = 0
 
@@ -174,7 +168,7 @@ class Exploration_Env(habitat.RLEnv):
         if self.args.frame_width != self.args.env_frame_width:
             rgb = np.asarray(self.res(rgb))
         state = rgb.transpose(2, 0, 1)
-        depth = _preprocess_depth(obs['depth'])
+        depth = self.preprocess_depth(obs['depth'])
 
         # Initialize map and pose
         self.map_size_cm = args.map_size_cm
@@ -198,12 +192,24 @@ class Exploration_Env(habitat.RLEnv):
 
         # Initialize variables
         self.scene_name = self.habitat_env.sim.habitat_config.SCENE
-        self.visited = np.zeros(self.map.shape)
-        self.visited_vis = np.zeros(self.map.shape)
-        self.visited_gt = np.zeros(self.map.shape)
-        self.collison_map = np.zeros(self.map.shape)
-        self.visited_count = np.zeros(self.map.shape)
-        self.fmm_dist = np.zeros(self.map.shape)
+        self.visited = np.zeros(self.map.shape, dtype=np.uint8)
+        self.visited_vis = np.zeros(self.map.shape, dtype=np.uint8)
+        self.visited_gt = np.zeros(self.map.shape, dtype=np.uint8)
+        self.collison_map = np.zeros(self.map.shape, dtype=np.uint8)
+        self.visited_count = np.zeros(self.map.shape, dtype=COUNT_DTYPE)
+        self.fmm_dist = np.zeros(self.map.shape, dtype=np.float32)
+        self.bfs_dist = np.empty(self.map.shape, dtype=np.int32)
+        # The ground truth map is static over the episode, so its obstacles
+        # are inflated once here instead of on every plan
+        self.inflated_gt_map = InflatedObstacleMap(self.selem)
+        self.inflated_gt_map.update(1 - self.explorable_map)
+        self.fmm_cache = FMMDistanceCache()
+        # Frontier segments with persistent IDs, the clusters ranked by
+        # _rank_frontiers, only kept when frontiers are scored
+        self.frontier_segments = None
+        if args.frontier_scoring:
+            self.frontier_segments = FrontierSegments(self.map.shape)
+            self.frontier_segments.update(self.frontier)
         self.num_explored = []
         self.num_forward = []
         self.num_forward_step = 0
@@ -211,14 +217,15 @@ class Exploration_Env(habitat.RLEnv):
         self.collision_flag = 0
         self.goal = [0,0]
         self.goal_arbitrary = [0,0]
+        self.frontier_ranking = []
         self.option = 0
         self.change_goal_flag = False
 
         # Set info
         self.info = {
             'time': self.timestep,
-            'fp_proj': self.map,
-            'fp_explored': self.explored_map,
+            'fp_proj': PackedMap(self.map),
+            'fp_explored': PackedMap(self.explored_map),
             'sensor_pose': [0., 0., 0.],
             'pose_err': [0., 0., 0.],
         }
@@ -261,7 +268,7 @@ class Exploration_Env(habitat.RLEnv):
 
         state = rgb.transpose(2, 0, 1)
 
-        depth = _preprocess_depth(obs['depth'])
+        depth = self.preprocess_depth(obs['depth'])
 
         # Get base sensor and ground-truth pose
         dx_gt, dy_gt, do_gt = self.get_gt_pose_change()
@@ -287,6 +294,9 @@ class Exploration_Env(habitat.RLEnv):
         # Update ground_truth map and explored area
         fp_proj, self.map, fp_explored, self.explored_map, self.new_explored, self.frontier, self.frontier_clusters = \
                 self.mapper.update_map(depth, mapper_gt_pose)
+        if self.frontier_segments is not None:
+            self.frontier_segments.update(self.frontier,
+                                          self.mapper.changed_window)
 
         self.collision_flag = 0
         # Update collision map
@@ -322,8 +332,8 @@ class Exploration_Env(habitat.RLEnv):
 
         # Set info
         self.info['time'] = self.timestep
-        self.info['fp_proj'] = self.map, # occupancy map
-        self.info['fp_explored']= self.explored_map, # explored map
+        self.info['fp_proj'] = PackedMap(self.map), # occupancy map
+        self.info['fp_explored']= PackedMap(self.explored_map), # explored map
         self.info['sensor_pose'] = [self.curr_loc_gt[0],
                                     self.curr_loc_gt[1],
                                     np.deg2rad(self.curr_loc_gt[2])]
@@ -429,7 +439,8 @@ class Exploration_Env(habitat.RLEnv):
         #frontier rewards
         r, c = [int(self.curr_loc_gt[1] * 100.0 / self.args.map_resolution),
                 int(self.curr_loc_gt[0] * 100.0 / self.args.map_resolution)]
-        m_reward = bfs(self.map, self.explored_map, self.frontier, (r,c))
+        m_reward = bfs(self.map, self.explored_map, self.frontier, (r,c),
+                       self.bfs_dist)
         if not m_reward == 0:
             m_reward = 1./m_reward
 
@@ -452,6 +463,10 @@ class Exploration_Env(habitat.RLEnv):
     def get_spaces(self):
         return self.observation_space, self.action_space
 
+    def close(self):
+        self.mapper.close()
+        super().close()
+
     def build_mapper(self):
         params = {}
         params['frame_width'] = self.args.env_frame_width
@@ -467,6 +482,12 @@ class Exploration_Env(habitat.RLEnv):
         params['vision_range'] = self.args.vision_range
         params['visualize'] = self.args.visualize
         params['obs_threshold'] = self.args.obs_threshold #1
+        params['incremental_map'] = self.args.incremental_map
+        params['log_odds_map'] = self.args.log_odds_map
+        params['clustering_algo'] = self.args.frontier_clustering
+        params['recluster_threshold'] = self.args.recluster_threshold
+        params['async_clustering'] = self.args.async_clustering
+        params['clustering_workers'] = self.args.clustering_workers
         self.selem = skimage.morphology.disk(self.args.obstacle_boundary /
                                              self.args.map_resolution)
         mapper = MapBuilder(params)
@@ -585,6 +606,13 @@ class Exploration_Env(habitat.RLEnv):
         self.change_goal_flag = inputs['change_goal'] # True, if navigation. False, if look-around.
         #goal[0] = 500
         #goal[1] = 20
+        if args.frontier_scoring and self.change_goal_flag:
+            # A single distance field from the agent scores every frontier
+            # cluster, so the goal is reachable before planning towards it
+            self.frontier_ranking = self._rank_frontiers(
+                self.inflated_gt_map, start, planning_window)
+            if len(self.frontier_ranking) > 0:
+                goal = self.frontier_ranking[0]['cell']
         goal = pu.threshold_poses(goal, grid.shape)
         self.goal = goal
         self.goal_arbitrary = goal_arbitrary # brought in purely for visualization.
@@ -598,11 +626,11 @@ class Exploration_Env(habitat.RLEnv):
         #print(self.explorable_map[int(goal[1]), int(goal[0])])
         if self.args.eval == 1: # same either way.
 
-            gt_action, stg_x_gt, stg_y_gt, self.fmm_dist, goal_reached, new_goal = self._get_gt_action((1 - self.explorable_map), start,  #self.map
+            gt_action, stg_x_gt, stg_y_gt, fmm_dist, goal_reached, new_goal = self._get_gt_action(self.inflated_gt_map, start,  #self.map
                                             [int(goal[0]), int(goal[1])],
                                             planning_window, start_o_gt)
         else:
-            gt_action, stg_x_gt, stg_y_gt, self.fmm_dist, goal_reached, new_goal = self._get_gt_action((1 - self.explorable_map), start, #self.map
+            gt_action, stg_x_gt, stg_y_gt, fmm_dist, goal_reached, new_goal = self._get_gt_action(self.inflated_gt_map, start, #self.map
                                             [int(goal[0]), int(goal[1])],
                                             planning_window, start_o_gt) #new_goal out = goal in.
             
@@ -687,6 +715,22 @@ class Exploration_Env(habitat.RLEnv):
                         args.print_images, args.vis_type)
            
 
+    def _rank_frontiers(self, inflated, start, planning_window):
+        """Ranks the frontier segments of the planning window, labelled by
+        their persistent IDs, by information gain over geodesic distance
+        from the agent, on the same traversible map as _get_gt_action, see
+        rank_frontier_clusters"""
+        [gx1, gx2, gy1, gy2] = planning_window
+
+        traversible = self._get_traversible(
+            inflated, planning_window, start, [0, gx2 - gx1, 0, gy2 - gy1])
+
+        self.agent_fmm_dist = get_geodesic_distance(
+            traversible, ([int(start[0])], [int(start[1])]))
+        return rank_frontier_clusters(
+            self.agent_fmm_dist, self.frontier[gx1:gx2, gy1:gy2],
+            self.frontier_segments.labels[gx1:gx2, gy1:gy2])
+
     def _get_gt_map(self, full_map_size):
         self.scene_name = self.habitat_env.sim.habitat_config.SCENE
         logger.error('Computing map for %s', self.scene_name)
@@ -834,7 +878,7 @@ class Exploration_Env(habitat.RLEnv):
 
         stg_x, stg_y = start[0] - x1 + 1, start[1] - y1 + 1
         for i in range(self.args.short_goal_dist):
-            stg_x, stg_y, replan = planner.get_short_term_goal([stg_x, stg_y])
+            stg_x, stg_y, replan, _ = planner.get_short_term_goal([stg_x, stg_y])
         if replan:
             stg_x, stg_y = start[0], start[1]
         else:
@@ -842,71 +886,108 @@ class Exploration_Env(habitat.RLEnv):
 
         return (stg_x, stg_y)
 
-    def _get_gt_action(self, grid, start, goal, planning_window, start_o):
+    def _get_planning_box(self, start, goal, buf, shape, block=32):
+        """Box [x1, x2, y1, y2] of the planning window to plan in: the
+        start and the goal with buf cells around them, rounded out to
+        multiples of block cells so that it stays the same, and the cached
+        distance field valid, over consecutive steps. The whole window if
+        windowed planning is off."""
+        if not self.args.windowed_planning:
+            return [0, shape[0], 0, shape[1]]
+        x1 = int(min(start[0], goal[0]) - buf) // block * block
+        y1 = int(min(start[1], goal[1]) - buf) // block * block
+        x2 = -(-int(max(start[0], goal[0]) + buf + 1) // block) * block
+        y2 = -(-int(max(start[1], goal[1]) + buf + 1) // block) * block
+        return [max(0, x1), min(shape[0], x2), max(0, y1), min(shape[1], y2)]
+
+    def _get_traversible(self, inflated, planning_window, start, box):
+        """Traversible map of box [x1, x2, y1, y2] of the planning window:
+        free of the obstacles of the InflatedObstacleMap inflated, or
+        visited, or around the start."""
+        [gx1, gx2, gy1, gy2] = planning_window
+        x1, x2, y1, y2 = box
+
+        traversible = inflated.map[gx1:gx2, gy1:gy2][x1:x2, y1:y2] != True
+        traversible[self.visited[gx1:gx2, gy1:gy2][x1:x2, y1:y2] == 1] = 1
+        traversible[max(0, int(start[0]-x1)-1):int(start[0]-x1)+2,
+                    max(0, int(start[1]-y1)-1):int(start[1]-y1)+2] = 1
+        return traversible
+
+    def _get_gt_action(self, inflated, start, goal, planning_window, start_o):
+        # inflated is the InflatedObstacleMap of the obstacle map dilated
+        # by the agent footprint
         
         [gx1, gx2, gy1, gy2] = planning_window
 
-        x1 = min(start[0], goal[0])
-        x2 = max(start[0], goal[0])
-        y1 = min(start[1], goal[1])
-        y2 = max(start[1], goal[1])
         dist = pu.get_l2_distance(goal[0], start[0], goal[1], start[1])
 
-        if dist < 4:
-            goal_reached = True
-        else:
-            goal_reached = False
-
         buf = max(20., dist)
-        x1 = max(0, int(x1 - buf))
-        x2 = min(grid.shape[0], int(x2 + buf))
-        y1 = max(0, int(y1 - buf))
-        y2 = min(grid.shape[1], int(y2 + buf))
-
-        x1 = 0
-        y1 = 0
-        x2 = grid.shape[0]
-        y2 = grid.shape[1]
-
-
+        window_shape = (gx2 - gx1, gy2 - gy1)
+        full_box = [0, window_shape[0], 0, window_shape[1]]
 
         path_found = False
-        goal_r = 0
+        goal_projected = False
         while not path_found:
+            x1, x2, y1, y2 = self._get_planning_box(start, goal, buf,
+                                                    window_shape)
         
-            traversible = skimage.morphology.binary_dilation(
-            grid[gx1:gx2, gy1:gy2][x1:x2, y1:y2],
-            self.selem) != True
-
-            traversible[self.visited[gx1:gx2, gy1:gy2][x1:x2, y1:y2] == 1] = 1
-            traversible[int(start[0]-x1)-1:int(start[0]-x1)+2,
-                        int(start[1]-y1)-1:int(start[1]-y1)+2] = 1
-            traversible[int(goal[0]-x1)-goal_r:int(goal[0]-x1)+goal_r+1,
-                        int(goal[1]-y1)-goal_r:int(goal[1]-y1)+goal_r+1] = 1
+            traversible = self._get_traversible(inflated, planning_window,
+                                                start, [x1, x2, y1, y2])
+            traversible[int(goal[0]-x1), int(goal[1]-y1)] = 1
             scale = 1
 
-            planner = FMMPlanner(traversible, 360//self.dt, scale)
+            # Between plans in the same box of the same inflated map, the
+            # traversible map only changes where the visited cells and the
+            # start area are marked, around the start
+            cache_key = (tuple(planning_window), x1, x2, y1, y2,
+                         inflated.version)
+            changed_window = [int(start[0]) - 2 - x1, int(start[0]) + 3 - x1,
+                              int(start[1]) - 2 - y1, int(start[1]) + 3 - y1]
+            planner = get_planner(self.args.planner)(
+                traversible, 360//self.dt, scale, cache=self.fmm_cache,
+                cache_key=cache_key, changed_window=changed_window)
 
             reachable = planner.set_goal([goal[1]-y1, goal[0]-x1])
+            if not reachable[int(start[0]-x1), int(start[1]-y1)]:
+                if [x1, x2, y1, y2] != full_box:
+                    # The path may leave the box, grow it, up to the
+                    # whole window
+                    buf = 2*buf
+                    continue
+                if not goal_projected:
+                    # Move the unreachable goal to the nearest cell of the
+                    # component of the start, once, the box being the
+                    # whole window
+                    goal_projected = True
+                    goal = get_reachable_goal(
+                        traversible, [int(start[0]), int(start[1])], goal)
+                    continue
 
             stg_x_gt, stg_y_gt = start[0] - x1, start[1] - y1
             for i in range(1):
                 stg_x_gt, stg_y_gt, replan, fmm_dist = \
                         planner.get_short_term_goal([stg_x_gt, stg_y_gt])
 
-            if replan and buf < 100.:
+            if replan and [x1, x2, y1, y2] != full_box:
+                # No path inside the box, grow it, up to the whole window
                 buf = 2*buf
-                x1 = max(0, int(x1 - buf))
-                x2 = min(grid.shape[0], int(x2 + buf))
-                y1 = max(0, int(y1 - buf))
-                y2 = min(grid.shape[1], int(y2 + buf))
-            elif replan and goal_r < 50:
-                goal_r += 1
             else:
                 path_found = True
 
+        # Kept in the float32 buffer of the map for the visualization, the
+        # cells the planner has no distance for at the largest distance
+        r1, r2, c1, c2 = planner.dist_box
+        self.fmm_dist.fill(fmm_dist.max())
+        self.fmm_dist[gx1:gx2, gy1:gy2][x1:x2, y1:y2][r1:r2, c1:c2] = fmm_dist
+
         stg_x_gt, stg_y_gt = stg_x_gt + x1, stg_y_gt + y1
 
+        dist = pu.get_l2_distance(goal[0], start[0], goal[1], start[1])
+        if dist < 4:
+            goal_reached = True
+        else:
+            goal_reached = False
+
 
 
         #print("start")
@@ -0,0 +1,30 @@
+import numpy as np
+
+
+class DepthPreprocessor(object):
+    """
+    Converts habitat depth observations (normalised to [0, 1]) into depth in
+    cm for the mapper. Readings above 0.99 and zeros are replaced by the max
+    of their image column, columns without any valid reading become NaN.
+    All of it is done with a fixed number of array operations on buffers
+    allocated once, so the returned array is overwritten by the next call.
+    """
+
+    def __init__(self, height, width):
+        self.depth = np.empty((height, width), dtype=np.float32)
+        self.mask = np.empty((height, width), dtype=bool)
+        self.col_max = np.empty((width,), dtype=np.float32)
+
+    def __call__(self, depth):
+        np.copyto(self.depth, depth[:, :, 0])
+        np.greater(self.depth, 0.99, out=self.mask)
+        np.putmask(self.depth, self.mask, 0.)
+
+        np.max(self.depth, axis=0, out=self.col_max)
+        np.equal(self.depth, 0., out=self.mask)
+        np.copyto(self.depth, self.col_max, where=self.mask)
+
+        np.equal(self.depth, 0., out=self.mask)
+        np.putmask(self.depth, self.mask, np.NaN)
+        self.depth *= 1000.
+        return self.depth
@@ -1,20 +1,86 @@
+from array import array
+
 import numpy as np
-from collections import deque 
-
-def bfs(obstacle, explored, frontier, start):
-
-    height, width = obstacle.shape
-    queue = deque([[start]])
-    seen = set([start])
-    while queue:
-        path = queue.popleft()
-        x, y = path[-1]
-        if frontier[x][y] == 1:
-            #print(len(path))
-            return len(path)
-        for x2, y2 in ((x+1,y), (x-1,y), (x,y+1), (x,y-1)):
-            if 0 <= x2 < width and 0 <= y2 < height and obstacle[x2][y2] == 0 and explored[x2][y2] == 1 and (x2, y2) not in seen:
-                queue.append(path + [(x2, y2)])
-                seen.add((x2, y2))
+
+
+def _get_passable(obstacle, explored):
+    return (np.asarray(obstacle) == 0) & (np.asarray(explored) == 1)
+
+
+def bfs(obstacle, explored, frontier, start, dist=None):
+    """
+    Length of the shortest 4-connected path from start to the nearest
+    frontier cell through explored free cells, counted in cells with start
+    included, or 0 if no frontier cell can be reached.
+
+    dist is an optional int32 buffer of the map shape, left holding the
+    distance from start of the cells reached before the search stopped and
+    -1 elsewhere.
+    """
+    return bfs_wavefront(obstacle, explored, frontier, start, dist)
+
+
+def bfs_queue(obstacle, explored, frontier, start, dist=None):
+    """Same as bfs, visiting one cell at a time with a queue of flat
+    indices. The search runs on bytes and array objects, as indexing numpy
+    arrays one element at a time is much slower."""
+    height, width = np.shape(obstacle)
+    passable = _get_passable(obstacle, explored).tobytes()
+    frontier = (np.asarray(frontier) == 1).tobytes()
+    if dist is None:
+        dist = np.empty((height, width), dtype=np.int32)
+    flat_dist = array('i', [-1]) * (height * width)
+
+    queue = [start[0] * width + start[1]]
+    flat_dist[queue[0]] = 0
+    length = 0
+    for i in queue:
+        if frontier[i]:
+            length = flat_dist[i] + 1
+            break
+        y = i % width
+        level = flat_dist[i] + 1
+        for j, valid in ((i + width, i + width < height * width),
+                         (i - width, i >= width),
+                         (i + 1, y + 1 < width), (i - 1, y > 0)):
+            if valid and passable[j] and flat_dist[j] < 0:
+                flat_dist[j] = level
+                queue.append(j)
+    dist.reshape(-1)[:] = np.frombuffer(flat_dist, dtype=np.int32)
+    return length
+
+
+def bfs_wavefront(obstacle, explored, frontier, start, dist=None):
+    """Same as bfs, expanding a whole wavefront of cells with numpy at each
+    step. Every cell enters a wavefront at most once, so the search is
+    linear in the number of cells reached."""
+    height, width = np.shape(obstacle)
+    passable = _get_passable(obstacle, explored).ravel()
+    frontier = (np.asarray(frontier) == 1).ravel()
+    if dist is None:
+        dist = np.empty((height, width), dtype=np.int32)
+    dist.fill(-1)
+    flat_dist = dist.reshape(-1)
+
+    wave = np.array([start[0] * width + start[1]], dtype=np.int64)
+    flat_dist[wave] = 0
+    level = 0
+    while wave.size > 0:
+        if frontier[wave].any():
+            return level + 1
+        x, y = np.divmod(wave, width)
+        neighbours = np.concatenate((wave[x + 1 < height] + width,
+                                     wave[x > 0] - width,
+                                     wave[y + 1 < width] + 1,
+                                     wave[y > 0] - 1))
+        neighbours = neighbours[passable[neighbours] &
+                                (flat_dist[neighbours] < 0)]
+        # Drop the cells reached from two cells of the wave: each copy
+        # writes its own mark below -1 and only the copy whose mark stuck
+        # is kept
+        marks = -2 - np.arange(neighbours.size, dtype=np.int32)
+        flat_dist[neighbours] = marks
+        wave = neighbours[flat_dist[neighbours] == marks]
+        level += 1
+        flat_dist[wave] = level
     return 0
-      
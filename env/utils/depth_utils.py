@@ -55,6 +55,38 @@ def get_point_cloud_from_z(Y, camera_matrix, scale=1):
     return XYZ
 
 
+class CameraProjection(object):
+    """Per-pixel camera rays for a fixed camera, precomputed once from the
+    camera matrix and subsampling scale with the camera elevation folded in.
+    get_point_cloud gives the same point cloud as get_point_cloud_from_z
+    followed by transform_camera_view, as a single multiply of the depth by
+    the cached rays.
+    """
+
+    def __init__(self, camera_matrix, height, width, scale, sensor_height,
+                 camera_elevation_degree):
+        x, z = np.meshgrid(np.arange(width), np.arange(height - 1, -1, -1))
+        x, z = x[::scale, ::scale], z[::scale, ::scale]
+        rays = np.stack(((x - camera_matrix.xc) / camera_matrix.f,
+                         np.ones(x.shape),
+                         (z - camera_matrix.zc) / camera_matrix.f), axis=-1)
+        R = ru.get_r_matrix([1., 0., 0.], angle=np.deg2rad(camera_elevation_degree))
+        self.rays = np.matmul(rays.reshape(-1, 3), R.T).reshape(rays.shape)
+        self.scale = scale
+        self.sensor_height = sensor_height
+
+    def get_point_cloud(self, Y):
+        """Projects the depth image Y into the camera-view point cloud.
+        Inputs:
+            Y is ...xHxW
+        Outputs:
+            XYZ is ...xH'xW'x3, H' and W' being H and W subsampled by scale
+        """
+        XYZ = Y[..., ::self.scale, ::self.scale, np.newaxis] * self.rays
+        XYZ[..., 2] += self.sensor_height
+        return XYZ
+
+
 def transform_camera_view(XYZ, sensor_height, camera_elevation_degree):
     """
     Transforms the point cloud into geocentric frame to account for
@@ -113,8 +145,168 @@ def bin_points(XYZ_cms, map_size, z_bins, xy_resolution):
         ind[np.logical_not(isvalid)] = 0
         count = np.bincount(ind.ravel(), isvalid.ravel().astype(np.int32),
                             minlength=map_size * map_size * n_z_bins)
-        counts = np.reshape(count, [map_size, map_size, n_z_bins])
+        counts.append(np.reshape(count, [map_size, map_size, n_z_bins]))
 
+    counts = np.stack(counts)
     counts = counts.reshape(list(sh[:-3]) + [map_size, map_size, n_z_bins])
 
     return counts
+
+
+def bin_points_window(XYZ_cm, map_size, z_bins, xy_resolution):
+    """Bins the points of a single frame into xy-z bins like bin_points, but
+    only over the bounding box of the valid points instead of the whole map.
+    XYZ_cm is H x W x 3
+    Outputs are the counts, (y2 - y1) x (x2 - x1) x (len(z_bins)+1), and the
+    window [y1, y2, x1, x2] in map cells, or (None, None) if no point lands
+    inside the map.
+    """
+    n_z_bins = len(z_bins) + 1
+    isnotnan = np.logical_not(np.isnan(XYZ_cm[:, :, 0]))
+    X_bin = np.round(XYZ_cm[:, :, 0] / xy_resolution).astype(np.int32)
+    Y_bin = np.round(XYZ_cm[:, :, 1] / xy_resolution).astype(np.int32)
+    Z_bin = np.digitize(XYZ_cm[:, :, 2], bins=z_bins).astype(np.int32)
+
+    isvalid = np.array([X_bin >= 0, X_bin < map_size, Y_bin >= 0, Y_bin < map_size,
+                        Z_bin >= 0, Z_bin < n_z_bins, isnotnan])
+    isvalid = np.all(isvalid, axis=0)
+    if not isvalid.any():
+        return None, None
+
+    X_bin, Y_bin, Z_bin = X_bin[isvalid], Y_bin[isvalid], Z_bin[isvalid]
+    x1, x2 = X_bin.min(), X_bin.max() + 1
+    y1, y2 = Y_bin.min(), Y_bin.max() + 1
+    h, w = y2 - y1, x2 - x1
+
+    ind = ((Y_bin - y1) * w + (X_bin - x1)) * n_z_bins + Z_bin
+    count = np.bincount(ind, minlength=h * w * n_z_bins)
+    counts = np.reshape(count, [h, w, n_z_bins])
+
+    return counts, [int(y1), int(y2), int(x1), int(x2)]
+
+
+def get_point_cloud_from_z_batch(Y, camera_matrix, scale=1):
+    """Projects a stack of depth images Y into 3D point clouds, in the same
+    frame as get_point_cloud_from_z.
+    Inputs:
+        Y is NxHxW
+        camera_matrix
+    Outputs:
+        XYZ is NxH'xW'x3, H' and W' being H and W subsampled by scale
+    """
+    x, z = np.meshgrid(np.arange(Y.shape[-1]),
+                       np.arange(Y.shape[-2] - 1, -1, -1))
+    x, z = x[::scale, ::scale], z[::scale, ::scale]
+    Y = Y[:, ::scale, ::scale]
+    X = (x - camera_matrix.xc) * Y / camera_matrix.f
+    Z = (z - camera_matrix.zc) * Y / camera_matrix.f
+    XYZ = np.stack((X, Y, Z), axis=-1)
+    return XYZ
+
+
+def transform_pose_batch(XYZ, poses):
+    """
+    Transforms a stack of point clouds into the geocentric frame, one camera
+    position per point cloud
+    Input:
+        XYZ                     : Nx...x3
+        poses                   : Nx3 camera positions (x, y, theta (radians))
+    Output:
+        XYZ : Nx...x3
+    """
+    poses = np.asarray(poses, dtype=np.float64).reshape(-1, 3)
+    n = poses.shape[0]
+    R = np.stack([ru.get_r_matrix([0., 0., 1.], angle=pose[2] - np.pi / 2.)
+                  for pose in poses])
+    sh = XYZ.shape
+    XYZ = np.matmul(XYZ.reshape(n, -1, 3), R.transpose(0, 2, 1))
+    XYZ[:, :, 0] = XYZ[:, :, 0] + poses[:, 0:1]
+    XYZ[:, :, 1] = XYZ[:, :, 1] + poses[:, 1:2]
+    return XYZ.reshape(sh)
+
+
+def bin_points_batch(XYZ_cms, map_size, z_bins, xy_resolution):
+    """Bins a stack of point clouds into xy-z bins with a single bincount
+    XYZ_cms is ... x H x W x3
+    Outputs is ... x map_size x map_size x (len(z_bins)+1)
+    """
+    sh = XYZ_cms.shape
+    XYZ_cms = XYZ_cms.reshape([-1, sh[-3], sh[-2], sh[-1]])
+    n = XYZ_cms.shape[0]
+    n_z_bins = len(z_bins) + 1
+
+    isnotnan = np.logical_not(np.isnan(XYZ_cms[..., 0]))
+    X_bin = np.round(XYZ_cms[..., 0] / xy_resolution).astype(np.int64)
+    Y_bin = np.round(XYZ_cms[..., 1] / xy_resolution).astype(np.int64)
+    Z_bin = np.digitize(XYZ_cms[..., 2], bins=z_bins).astype(np.int64)
+
+    isvalid = np.array([X_bin >= 0, X_bin < map_size, Y_bin >= 0, Y_bin < map_size,
+                        Z_bin >= 0, Z_bin < n_z_bins, isnotnan])
+    isvalid = np.all(isvalid, axis=0)
+
+    # Offsetting every frame by its own map keeps all frames in one bincount.
+    frame = np.arange(n).reshape(-1, 1, 1)
+    ind = ((frame * map_size + Y_bin) * map_size + X_bin) * n_z_bins + Z_bin
+    ind[np.logical_not(isvalid)] = 0
+    count = np.bincount(ind.ravel(), isvalid.ravel().astype(np.int32),
+                        minlength=n * map_size * map_size * n_z_bins)
+
+    counts = count.reshape(list(sh[:-3]) + [map_size, map_size, n_z_bins])
+    return counts
+
+
+def get_binned_points_from_z_batch(Y, poses, camera_matrix, scale,
+                                   sensor_height, camera_elevation_degree,
+                                   map_size, z_bins, xy_resolution):
+    """Projects a stack of depth images, taken at the given camera positions,
+    into geocentric xy-z bins in one vectorised pass. This is the batched
+    equivalent of get_point_cloud_from_z, transform_camera_view,
+    transform_pose and bin_points applied frame by frame.
+    Inputs:
+        Y is NxHxW depth in cm, NaN where invalid
+        poses is Nx3 camera positions (x, y, theta (radians))
+    Outputs:
+        counts is N x map_size x map_size x (len(z_bins)+1)
+    """
+    XYZ = get_point_cloud_from_z_batch(Y, camera_matrix, scale)
+    XYZ = transform_camera_view(XYZ, sensor_height, camera_elevation_degree)
+    XYZ = transform_pose_batch(XYZ, poses)
+    return bin_points_batch(XYZ, map_size, z_bins, xy_resolution)
+
+
+def get_free_space_points(XYZ_cm, origin, z_bins, max_range, step):
+    """Samples the free space seen between the camera and the points of a
+    single frame, one ray per image column.
+    A column's ray ends at its nearest point in the obstacle z range
+    [z_bins[0], z_bins[-1]), or at its farthest point if it has none, and is
+    sampled every step cm up to one step short of that end.
+    XYZ_cm is H x W x 3 geocentric points, NaN where invalid
+    origin is the camera (x, y) in cm
+    Outputs are the x and y of the samples in cm, as flat arrays.
+    """
+    dx = XYZ_cm[:, :, 0] - origin[0]
+    dy = XYZ_cm[:, :, 1] - origin[1]
+    dist = np.sqrt(dx ** 2 + dy ** 2)
+    isvalid = np.logical_not(np.isnan(dist))
+    with np.errstate(invalid="ignore"):
+        isobstacle = isvalid & (XYZ_cm[:, :, 2] >= z_bins[0]) & \
+            (XYZ_cm[:, :, 2] < z_bins[-1])
+
+    far_ind = np.argmax(np.where(isvalid, dist, -1.), axis=0)
+    cols = np.arange(dist.shape[1])
+    far = np.where(isvalid.any(0), dist[far_ind, cols], 0.)
+    near_obstacle = np.where(isobstacle, dist, np.inf).min(0)
+    ray_length = np.minimum(np.where(np.isinf(near_obstacle), far, near_obstacle),
+                            max_range)
+
+    # All points of a column share its bearing, so it is taken from the
+    # farthest one.
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ux = np.where(far > 0, dx[far_ind, cols] / far, 0.)
+        uy = np.where(far > 0, dy[far_ind, cols] / far, 0.)
+
+    t = np.arange(0., max_range, step)
+    keep = t[np.newaxis, :] < (ray_length[:, np.newaxis] - step)
+    xs = origin[0] + ux[:, np.newaxis] * t
+    ys = origin[1] + uy[:, np.newaxis] * t
+    return xs[keep], ys[keep]
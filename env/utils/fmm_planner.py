@@ -2,10 +2,17 @@ import cv2
 import numpy as np
 import skfmm
 from numpy import ma
+from scipy import ndimage
 
 num_rots = 36
 
 
+# Subpixel offsets of the short-term goal step masks kept in lookup tables,
+# in 1/MASK_RESOLUTION steps of a cell
+MASK_RESOLUTION = 16
+_mask_tables = {}
+
+
 def get_mask(sx, sy, scale, step_size):
     size = int(step_size // scale) * 2 + 1
     mask = np.zeros((size, size))
@@ -29,10 +36,164 @@ def get_dist(sx, sy, scale, step_size):
     return mask
 
 
+def get_mask_table(scale, step_size):
+    """Step masks and distance masks for the subpixel offsets multiple of
+    1/MASK_RESOLUTION, indexed [sx, sy, i, j], computed once per scale and
+    step size."""
+    key = (scale, step_size)
+    if key not in _mask_tables:
+        offsets = np.arange(MASK_RESOLUTION) / MASK_RESOLUTION
+        masks = np.array([[get_mask(sx, sy, scale, step_size)
+                           for sy in offsets] for sx in offsets])
+        dists = np.array([[get_dist(sx, sy, scale, step_size)
+                           for sy in offsets] for sx in offsets])
+        masks.flags.writeable = False
+        dists.flags.writeable = False
+        _mask_tables[key] = (masks, dists)
+    return _mask_tables[key]
+
+
+def get_step_masks(sx, sy, scale, step_size):
+    """get_mask and get_dist of the subpixel offset (sx, sy), read from the
+    lookup table when the offset is on its grid."""
+    qx, qy = sx * MASK_RESOLUTION, sy * MASK_RESOLUTION
+    if qx == int(qx) and qy == int(qy) and \
+            0 <= qx < MASK_RESOLUTION and 0 <= qy < MASK_RESOLUTION:
+        masks, dists = get_mask_table(scale, step_size)
+        return masks[int(qx), int(qy)], dists[int(qx), int(qy)]
+    return get_mask(sx, sy, scale, step_size), \
+        get_dist(sx, sy, scale, step_size)
+
+
+def get_window(array, x, y, radius, fill):
+    """array[x - radius:x + radius + 1, y - radius:y + radius + 1] as a new
+    array, with the cells outside array set to fill, which is the same as
+    padding array by radius cells and slicing, without the padding."""
+    size = 2 * radius + 1
+    window = np.full((size, size), fill, dtype=array.dtype)
+    x1, x2 = max(0, x - radius), min(array.shape[0], x + radius + 1)
+    y1, y2 = max(0, y - radius), min(array.shape[1], y + radius + 1)
+    if x1 < x2 and y1 < y2:
+        window[x1 - x + radius:x2 - x + radius,
+               y1 - y + radius:y2 - y + radius] = array[x1:x2, y1:y2]
+    return window
+
+
+def get_geodesic_distance(traversible, sources):
+    """Geodesic distance to the nearest of the source cells (rows, cols)
+    from every cell of the traversible map, in a single fast marching pass.
+    Cells that are not traversible or not reachable are masked."""
+    traversible_ma = ma.masked_values(traversible * 1, 0)
+    traversible_ma[sources] = 0
+    return skfmm.distance(traversible_ma, dx=1)
+
+
+def get_reachable_goal(traversible, start, goal):
+    """Returns goal if the fast marching can reach it from start on the
+    traversible map (same 4-connected component), else the cell of the
+    component of start nearest to goal, the first in row-major order on
+    ties. The goal cell itself counts as traversible, as in set_goal."""
+    traversible = np.array(traversible, dtype=bool)
+    traversible[goal[0], goal[1]] = True
+    labels, _ = ndimage.label(traversible)
+    label = labels[start[0], start[1]]
+    if label == 0 or labels[goal[0], goal[1]] == label:
+        return goal
+    rows, cols = np.nonzero(labels == label)
+    i = np.argmin((rows - goal[0]) ** 2 + (cols - goal[1]) ** 2)
+    return [int(rows[i]), int(cols[i])]
+
+
+class FMMDistanceCache(object):
+    """
+    Goal-rooted distance field of the last FMMPlanner.set_goal call, reused
+    while the goal is the same and the traversible map only changed away
+    from the cells reachable from the goal. The reachable region is closed
+    by non-traversible cells, so changes that do not touch it leave its
+    distances unchanged. version counts the distance fields computed.
+
+    Lookups compare the whole traversible map, unless the caller passes a
+    key (e.g. the box planned in and the version of the obstacle map it is
+    built from) and a window bounding the cells that may have changed since
+    the last lookup with the same key. Then only the cells of that window
+    and of the previous one are compared.
+
+    A change touching the reachable region invalidates the whole field, and
+    set_goal then recomputes it over the whole map: a single cell can change
+    the distances of every cell whose paths pass by it, so there is no
+    smaller region to recompute.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.goal = None
+        self.traversible = None
+        self.fmm_dist = None
+        self.reachable = None
+        self.key = None
+        self.window = None
+        self.version = 0
+
+    def _compared_box(self, key, window):
+        h, w = self.traversible.shape
+        if key is None or key != self.key or window is None or \
+                self.window is None:
+            return [0, h, 0, w]
+        # The cells forced in the previous window may have been released
+        x1, x2 = min(window[0], self.window[0]), max(window[1], self.window[1])
+        y1, y2 = min(window[2], self.window[2]), max(window[3], self.window[3])
+        return [min(max(x1, 0), h), min(max(x2, 0), h),
+                min(max(y1, 0), w), min(max(y2, 0), w)]
+
+    def get(self, goal, traversible, key=None, window=None):
+        """Returns the cached (fmm_dist, reachable) if they hold for goal
+        on traversible, else None. window [x1, x2, y1, y2] bounds the cells
+        changed since the last lookup with the same key, see above."""
+        if self.goal != goal or self.traversible is None or \
+                self.traversible.shape != traversible.shape:
+            return None
+
+        x1, x2, y1, y2 = self._compared_box(key, window)
+        changed = traversible[x1:x2, y1:y2] != self.traversible[x1:x2, y1:y2]
+        if changed.any():
+            # Changed cells in the 8-neighbourhood of the reachable region
+            rows, cols = np.nonzero(changed)
+            rows, cols = rows + x1, cols + y1
+            h, w = self.reachable.shape
+            for dr in (-1, 0, 1):
+                for dc in (-1, 0, 1):
+                    if self.reachable[np.clip(rows + dr, 0, h - 1),
+                                      np.clip(cols + dc, 0, w - 1)].any():
+                        return None
+            self.traversible[rows, cols] = traversible[rows, cols]
+        self.key, self.window = key, window
+        return self.fmm_dist, self.reachable
+
+    def put(self, goal, traversible, fmm_dist, reachable, key=None,
+            window=None):
+        self.goal = goal
+        self.traversible = np.array(traversible, copy=True)
+        self.fmm_dist = fmm_dist
+        self.reachable = reachable
+        self.key, self.window = key, window
+        self.version += 1
+
+
 class FMMPlanner():
-    def __init__(self, traversible, num_rots, scale=1, step_size=5):
+    def __init__(self, traversible, num_rots, scale=1, step_size=5,
+                 cache=None, cache_key=None, changed_window=None):
         self.scale = scale
         self.step_size = step_size
+        # Distance field reuse across planners, see FMMDistanceCache
+        self.cache = cache
+        self.cache_key = cache_key
+        self.changed_window = changed_window
+        if changed_window is not None and scale != 1.:
+            x1, x2, y1, y2 = changed_window
+            self.changed_window = [int(x1 // scale), -int(-x2 // scale),
+                                   int(y1 // scale), -int(-y2 // scale)]
         if scale != 1.:
             self.traversible = cv2.resize(traversible,
                                           (traversible.shape[1] // scale, traversible.shape[0] // scale),
@@ -40,42 +201,48 @@ class FMMPlanner():
             self.traversible = np.rint(self.traversible)
         else:
             self.traversible = traversible
+        # Cells [r1, r2, c1, c2] covered by the distances returned with the
+        # short-term goals, the whole map
+        self.dist_box = [0, self.traversible.shape[0],
+                         0, self.traversible.shape[1]]
 
         self.angle_value = [0, 2.0 * np.pi / num_rots, -2.0 * np.pi / num_rots, 0]
         self.du = int(self.step_size / (self.scale * 1.))
         self.num_rots = num_rots
 
     def set_goal(self, goal):
-        traversible_ma = ma.masked_values(self.traversible * 1, 0)
         goal_x, goal_y = int(goal[0] / (self.scale * 1.)), \
                          int(goal[1] / (self.scale * 1.))
+        if self.cache is not None:
+            cached = self.cache.get((goal_x, goal_y), self.traversible,
+                                    self.cache_key, self.changed_window)
+            if cached is not None:
+                self.fmm_dist, dd_mask = cached
+                return dd_mask
+
+        traversible_ma = ma.masked_values(self.traversible * 1, 0)
         traversible_ma[goal_y, goal_x] = 0
         dd = skfmm.distance(traversible_ma, dx=1)
         dd_mask = np.invert(np.isnan(ma.filled(dd, np.nan)))
         dd = ma.filled(dd, np.max(dd) + 1)
         self.fmm_dist = dd
+        if self.cache is not None:
+            self.cache.put((goal_x, goal_y), self.traversible, dd, dd_mask,
+                           self.cache_key, self.changed_window)
         return dd_mask
 
     def get_short_term_goal(self, state):
         scale = self.scale * 1.
         state = [x / scale for x in state]
         dx, dy = state[0] - int(state[0]), state[1] - int(state[1])
-        mask = get_mask(dx, dy, scale, self.step_size)
-        dist_mask = get_dist(dx, dy, scale, self.step_size)
+        mask, dist_mask = get_step_masks(dx, dy, scale, self.step_size)
 
 
         state = [int(x) for x in state]
         
 
-        dist = np.pad(self.fmm_dist, self.du,
-                      'constant', constant_values=self.fmm_dist.shape[0] ** 2)
-        subset = dist[state[0]:state[0] + 2 * self.du + 1,
-                 state[1]:state[1] + 2 * self.du + 1]
-
-
-        assert subset.shape[0] == 2 * self.du + 1 and \
-               subset.shape[1] == 2 * self.du + 1, \
-            "Planning error: unexpected subset shape {}".format(subset.shape)
+        subset = get_window(self.fmm_dist, state[0], state[1], self.du,
+                            self.fmm_dist.shape[0] ** 2)
 
         subset *= mask
         subset += (1 - mask) * self.fmm_dist.shape[0] ** 2
@@ -83,11 +250,8 @@ class FMMPlanner():
         ratio1 = subset / dist_mask
         subset[ratio1 < -1.5] = 1
 
-        trav = np.pad(self.traversible, self.du,
-                      'constant', constant_values=0)
-
-        subset_trav = trav[state[0]:state[0] +  2*self.du + 1,
-                      state[1]:state[1] +  2*self.du + 1]
+        subset_trav = get_window(self.traversible, state[0], state[1],
+                                 self.du, 0)
 
         traversible_ma = ma.masked_values(subset_trav * 1, 0)
         goal_x, goal_y = self.du, self.du
@@ -0,0 +1,404 @@
+import numpy as np
+from scipy import ndimage
+from scipy.spatial import cKDTree
+from scipy.ndimage.morphology import binary_dilation
+from skimage import morphology
+
+
+class FrontierTracker(object):
+    """
+    Maintains the frontier of a map incrementally: explored cells within the
+    frontier footprint of an unexplored cell, outside the obstacle footprint
+    of every obstacle and outside the footprint of every cell of the extra
+    exclusion layers (e.g. visited cells or bad goals), with isolated cells
+    removed. This is the same map as computing it over the whole grid, but
+    each update only recomputes around the cells that changed.
+    """
+
+    def __init__(self, shape, frontier_selem, obstacle_selem=None,
+                 exclusion_selems=(), frontier_map=None):
+        self.shape = tuple(shape)
+        self.frontier_selem = frontier_selem
+        self.obstacle_selem = frontier_selem if obstacle_selem is None \
+            else obstacle_selem
+        self.exclusion_selems = list(exclusion_selems)
+
+        # The frontier at a cell depends on the layers within the largest
+        # footprint radius r, and removing isolated cells on its neighbours,
+        # so a change can reach r + 1 cells away, and recomputing those needs
+        # the layers 2r + 2 cells away.
+        radius = max(s.shape[0] // 2 for s in
+                     [self.frontier_selem, self.obstacle_selem] +
+                     self.exclusion_selems)
+        self.margin = radius + 1
+
+        # frontier_map lets the caller provide the storage, e.g. the
+        # mapper's frontier buffer
+        self.map = np.zeros(self.shape, dtype=np.uint8) \
+            if frontier_map is None else frontier_map
+        self.indices = np.zeros((0,), dtype=np.int64)
+        self.last_layers = None
+        # Cells rewritten by the last update, [x1, x2, y1, y2]
+        self.window = [0, 0, 0, 0]
+
+    def reset(self):
+        self.map[:, :] = 0
+        self.indices = np.zeros((0,), dtype=np.int64)
+        self.last_layers = None
+        self.window = [0, 0, 0, 0]
+
+    def update(self, explored, obstacle, exclusions=(), window=None):
+        """Updates the frontier from the current explored, obstacle and
+        exclusion layers and returns the frontier map.
+        window [x1, x2, y1, y2] bounds the cells changed since the last
+        update. If it is None the changes are found by comparing the layers
+        with the ones of the previous update.
+        """
+        layers = [explored, obstacle] + list(exclusions)
+        if window is None:
+            window = self._get_changed_window(layers)
+            if window is None:
+                self.window = [0, 0, 0, 0]
+                return self.map
+        elif self.last_layers is not None:
+            x1, x2, y1, y2 = window
+            for last, layer in zip(self.last_layers, layers):
+                last[x1:x2, y1:y2] = layer[x1:x2, y1:y2]
+
+        self._update_window(layers, window)
+        return self.map
+
+    def get_points(self):
+        """Returns the (rows, cols) of the frontier cells, ordered as
+        np.nonzero would."""
+        return np.divmod(self.indices, self.shape[1])
+
+    def _get_changed_window(self, layers):
+        if self.last_layers is None:
+            self.last_layers = [np.zeros(self.shape, dtype=np.asarray(l).dtype)
+                                for l in layers]
+        changed = np.zeros(self.shape, dtype=bool)
+        for last, layer in zip(self.last_layers, layers):
+            changed |= last != layer
+            np.copyto(last, layer)
+
+        rows = np.flatnonzero(changed.any(1))
+        if rows.size == 0:
+            return None
+        cols = np.flatnonzero(changed.any(0))
+        return [rows[0], rows[-1] + 1, cols[0], cols[-1] + 1]
+
+    def _update_window(self, layers, window):
+        x1, x2, y1, y2 = window
+        h, w = self.shape
+        m = self.margin
+        rx1, rx2 = max(0, x1 - 2 * m), min(h, x2 + 2 * m)
+        ry1, ry2 = max(0, y1 - 2 * m), min(w, y2 + 2 * m)
+        wx1, wx2 = max(0, x1 - m), min(h, x2 + m)
+        wy1, wy2 = max(0, y1 - m), min(w, y2 + m)
+
+        explored = layers[0][rx1:rx2, ry1:ry2]
+        obstacle = layers[1][rx1:rx2, ry1:ry2]
+        contour = binary_dilation(explored == 0, self.frontier_selem) & \
+            (explored == 1)
+        contour = contour & (binary_dilation(obstacle, self.obstacle_selem) == 0)
+        for layer, selem in zip(layers[2:], self.exclusion_selems):
+            contour = contour & \
+                (binary_dilation(layer[rx1:rx2, ry1:ry2], selem) == 0)
+        contour = morphology.remove_small_objects(contour, 2)
+        contour = contour[wx1 - rx1:wx2 - rx1, wy1 - ry1:wy2 - ry1]
+
+        self.map[wx1:wx2, wy1:wy2] = contour
+        self.window = [wx1, wx2, wy1, wy2]
+
+        rows, cols = np.divmod(self.indices, w)
+        outside = (rows < wx1) | (rows >= wx2) | (cols < wy1) | (cols >= wy2)
+        new_rows, new_cols = np.nonzero(contour)
+        new_indices = (new_rows + wx1) * w + new_cols + wy1
+        self.indices = np.sort(np.concatenate(
+            [self.indices[outside], new_indices]))
+
+
+def make_frontier_tracker(shape):
+    """FrontierTracker of the frontier map of compute_frontier_map."""
+    return FrontierTracker(shape, morphology.disk(5),
+                           exclusion_selems=[morphology.disk(1),
+                                             morphology.disk(1)])
+
+
+def compute_frontier_map(obstacle, explored, visited, bad_frontier_map,
+                         tracker=None):
+    """
+    Frontier map of the drivers' global policy input: explored cells within
+    5 cells of an unexplored cell, more than 5 cells away from obstacles and
+    more than 1 cell away from the visited cells and the bad goals, with
+    isolated cells removed. With a tracker from make_frontier_tracker, only
+    the cells around the changes since its last update are recomputed.
+    """
+    if tracker is not None:
+        return tracker.update(explored, obstacle, [visited, bad_frontier_map])
+
+    selem = morphology.disk(5)
+    contour = binary_dilation(explored == 0, selem) & (explored == 1)
+    contour = contour & (binary_dilation(obstacle, selem) == 0)
+    contour = contour & (binary_dilation(visited, morphology.disk(1)) == 0)
+    contour = contour & \
+        (binary_dilation(bad_frontier_map, morphology.disk(1)) == 0)
+    return morphology.remove_small_objects(contour, 2)
+
+
+class FrontierSegments(object):
+    """
+    Index of the 8-connected segments of a frontier map. Each segment keeps
+    a persistent ID while it grows, shrinks or moves a little, together with
+    its size, centroid (row, col) and bounding box [r1, r2, c1, c2]. Updates
+    only relabel the segments that touch the changed window, so queries
+    and updates scale with the number of segments rather than the map area.
+    """
+
+    def __init__(self, shape):
+        self.shape = tuple(shape)
+        self.reset()
+
+    def reset(self):
+        self.labels = np.zeros(self.shape, dtype=np.int32)  # 0: no frontier
+        self.segments = {}  # id -> {'size', 'centroid', 'bbox'}
+        self.next_id = 1
+
+    def update(self, frontier_map, window=None):
+        """Relabels the segments touching window [x1, x2, y1, y2], the cells
+        of frontier_map that changed since the last update (all of them if
+        window is None)."""
+        h, w = self.shape
+        x1, x2, y1, y2 = [0, h, 0, w] if window is None else window
+        if x2 <= x1 or y2 <= y1:
+            return
+
+        # Grow the region until it contains every segment touching it, so
+        # that the segments outside it are unaffected.
+        region = [max(0, x1 - 1), min(h, x2 + 1), max(0, y1 - 1), min(w, y2 + 1)]
+        while True:
+            r1, r2, c1, c2 = region
+            ids = np.unique(self.labels[r1:r2, c1:c2])
+            ids = ids[ids > 0]
+            for i in ids:
+                b = self.segments[i]['bbox']
+                region = [min(region[0], b[0]), max(region[1], b[1]),
+                          min(region[2], b[2]), max(region[3], b[3])]
+            if region == [r1, r2, c1, c2]:
+                break
+
+        old = self.labels[r1:r2, c1:c2]
+        components, num = ndimage.label(
+            np.asarray(frontier_map[r1:r2, c1:c2]) > 0,
+            structure=np.ones((3, 3)))
+        for i in ids:
+            del self.segments[i]
+
+        # A component keeps the ID of the old segment it overlaps most
+        ids = np.zeros(num + 1, dtype=np.int32)
+        overlap = (components > 0) & (old > 0)
+        pairs, counts = np.unique(
+            components[overlap].astype(np.int64) << 32 | old[overlap],
+            return_counts=True)
+        taken = set()
+        for pair in pairs[np.argsort(-counts, kind='stable')]:
+            component, old_id = pair >> 32, pair & 0xffffffff
+            if ids[component] == 0 and old_id not in taken:
+                ids[component] = old_id
+                taken.add(old_id)
+        for component in np.flatnonzero(ids[1:] == 0) + 1:
+            ids[component] = self.next_id
+            self.next_id += 1
+        self.labels[r1:r2, c1:c2] = ids[components]
+
+        rows, cols = np.nonzero(components)
+        component_of = components[rows, cols]
+        sizes = np.bincount(component_of, minlength=num + 1)
+        sum_rows = np.bincount(component_of, rows + r1, num + 1)
+        sum_cols = np.bincount(component_of, cols + c1, num + 1)
+        for component, box in enumerate(ndimage.find_objects(components), 1):
+            self.segments[ids[component]] = {
+                'size': int(sizes[component]),
+                'centroid': (sum_rows[component] / sizes[component],
+                             sum_cols[component] / sizes[component]),
+                'bbox': [box[0].start + r1, box[0].stop + r1,
+                         box[1].start + c1, box[1].stop + c1],
+            }
+
+    def get_segment_id(self, r, c):
+        """Returns the ID of the segment at cell (r, c), 0 if none."""
+        return int(self.labels[r, c])
+
+    def nearest_cell(self, point):
+        """Returns the frontier cell (r, c) closest to point, ties going to
+        the first cell in row-major order, or None if there is none.
+        Segments are visited in order of the distance to their bounding
+        box, and only until that distance exceeds the best one found."""
+        if not self.segments:
+            return None
+        pr, pc = point
+        ids = np.array(list(self.segments))
+        boxes = np.array([self.segments[i]['bbox'] for i in ids])
+        dr = np.maximum(0, np.maximum(boxes[:, 0] - pr, pr - (boxes[:, 1] - 1)))
+        dc = np.maximum(0, np.maximum(boxes[:, 2] - pc, pc - (boxes[:, 3] - 1)))
+        bounds = dr ** 2 + dc ** 2
+
+        best = None
+        for k in np.argsort(bounds, kind='stable'):
+            if best is not None and bounds[k] > best[0]:
+                break
+            r1, r2, c1, c2 = boxes[k]
+            rows, cols = np.nonzero(self.labels[r1:r2, c1:c2] == ids[k])
+            rows, cols = rows + r1, cols + c1
+            dist = (rows - pr) ** 2 + (cols - pc) ** 2
+            j = np.argmin(dist)
+            candidate = (dist[j], rows[j] * self.shape[1] + cols[j])
+            if best is None or candidate < best:
+                best = candidate
+        return list(divmod(int(best[1]), self.shape[1]))
+
+
+class NearestFrontierIndex(object):
+    """
+    KD-tree over the frontier cells of several maps of the same shape, e.g.
+    the local frontier map of each env. The maps share one tree, with each
+    map's cells moved apart along a third axis, so that the queries of all
+    envs are answered by one batched tree query. Results are the same as an
+    argmin of the squared distance over the frontier cells, ties going to
+    the first cell in row-major order.
+    """
+
+    def __init__(self, num_maps, shape):
+        self.num_maps = num_maps
+        self.shape = tuple(shape)
+        # Farther apart than any two cells of a map
+        self.map_offset = 2 * (self.shape[0] + self.shape[1])
+        self.reset()
+
+    def reset(self):
+        self.points = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+                       for _ in range(self.num_maps)]
+        self.tree = None
+
+    def update(self, m, points):
+        """Sets the frontier cells (rows, cols) of map m, e.g. from
+        np.nonzero or FrontierTracker.get_points()."""
+        self.points[m] = (np.asarray(points[0]), np.asarray(points[1]))
+        self.tree = None
+
+    def _build(self):
+        rows = np.concatenate([p[0] for p in self.points])
+        cols = np.concatenate([p[1] for p in self.points])
+        maps = np.repeat(np.arange(self.num_maps),
+                         [len(p[0]) for p in self.points])
+        self.cells = np.stack([rows, cols, maps], axis=1)
+        self.tree = cKDTree(np.stack(
+            [rows, cols, maps * self.map_offset], axis=1).astype(float))
+
+    def query(self, m, point, k=1, exclude=None):
+        """Returns up to k frontier cells [r, c] of map m nearest to point,
+        nearest first, skipping the cells where exclude (a map, e.g. the
+        bad frontier map) is non-zero."""
+        return self._query([m], [point], k,
+                           None if exclude is None else [exclude])[0]
+
+    def query_batch(self, points, maps=None, exclude=None):
+        """Returns the nearest frontier cell [r, c] to points[i] in map
+        maps[i] (map i by default), or None if there is none, for all the
+        queries at once. exclude[m] is the exclusion map of map m."""
+        maps = list(range(len(points))) if maps is None else list(maps)
+        if exclude is not None:
+            exclude = [exclude[m] for m in maps]
+        return [cells[0] if cells else None
+                for cells in self._query(maps, points, 1, exclude)]
+
+    def _query(self, maps, points, k, exclude):
+        if self.tree is None:
+            self._build()
+        results = [None] * len(maps)
+        pending = list(range(len(maps)))
+        num_neighbours = k + 8
+        while pending:
+            sizes = [len(self.points[maps[i]][0]) for i in pending]
+            queries = np.array([[points[i][0], points[i][1],
+                                 maps[i] * self.map_offset] for i in pending],
+                               dtype=float)
+            count = min(num_neighbours, len(self.cells))
+            if count == 0:
+                return [[] for _ in maps]
+            _, neighbours = self.tree.query(queries, k=count)
+            neighbours = np.asarray(neighbours).reshape(len(pending), count)
+
+            retry = []
+            for i, size, found in zip(pending, sizes, neighbours):
+                found = found[found < len(self.cells)]
+                cells = self.cells[found]
+                cells = cells[cells[:, 2] == maps[i]]
+                dist = (cells[:, 0] - points[i][0]) ** 2 + \
+                    (cells[:, 1] - points[i][1]) ** 2
+                keep = np.ones(len(cells), dtype=bool)
+                if exclude is not None:
+                    keep = np.asarray(exclude[i])[cells[:, 0], cells[:, 1]] == 0
+                cells, kept_dist = cells[keep], dist[keep]
+                order = np.lexsort((cells[:, 0] * self.shape[1] + cells[:, 1],
+                                    kept_dist))[:k]
+                # Cells at the distance of the farthest neighbour returned
+                # may have been cut off, so those results are not final
+                complete = len(dist) >= size or (
+                    len(order) == k and len(dist) > 0 and
+                    kept_dist[order[-1]] < dist.max())
+                if complete:
+                    results[i] = [list(c) for c in cells[order, :2]]
+                else:
+                    retry.append(i)
+            pending = retry
+            num_neighbours *= 2
+        return results
+
+
+def rank_frontier_clusters(distance, frontier_map, labels=None,
+                           distance_weight=1.):
+    """
+    Ranks the frontier clusters by information gain over geodesic distance,
+    given the distance field from the agent (a masked array, e.g. from
+    get_geodesic_distance). The gain of a cluster is its number of frontier
+    cells and its distance is the one of its nearest reachable cell. labels
+    gives the clusters, the 8-connected frontier segments by default.
+
+    Returns a list of dicts with the keys 'label', 'cell' ([r, c], the
+    nearest reachable cell), 'distance', 'gain' and 'score', best first.
+    Clusters with no reachable cell are left out.
+    """
+    if labels is None:
+        labels, _ = ndimage.label(frontier_map > 0, np.ones((3, 3)))
+    rows, cols = np.nonzero((frontier_map > 0) & (labels > 0))
+    if rows.size == 0:
+        return []
+    cell_labels = labels[rows, cols]
+    gains = np.bincount(cell_labels)
+
+    dist = np.ma.getdata(distance)[rows, cols].astype(float)
+    dist[np.ma.getmaskarray(distance)[rows, cols]] = np.inf
+    reachable = np.isfinite(dist)
+    rows, cols = rows[reachable], cols[reachable]
+    cell_labels, dist = cell_labels[reachable], dist[reachable]
+    if rows.size == 0:
+        return []
+
+    # Nearest cell of each cluster, row-major first on ties (nonzero is
+    # row-major and lexsort is stable)
+    order = np.lexsort((dist, cell_labels))
+    first = order[np.r_[True, np.diff(cell_labels[order]) != 0]]
+
+    ranking = []
+    for i in first:
+        label = int(cell_labels[i])
+        ranking.append({'label': label,
+                        'cell': [int(rows[i]), int(cols[i])],
+                        'distance': float(dist[i]),
+                        'gain': int(gains[label]),
+                        'score': float(gains[label] /
+                                       (1. + distance_weight * dist[i]))})
+    ranking.sort(key=lambda cluster: -cluster['score'])
+    return ranking
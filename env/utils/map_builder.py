@@ -1,9 +1,19 @@
 import numpy as np
 
 import env.utils.depth_utils as du
+from env.utils.map_state import COUNT_DTYPE, accumulate_counts
+from env.utils.frontier import FrontierTracker
 from scipy.ndimage.morphology import binary_dilation
 from skimage import morphology
-from clustering import frontier_clustering
+from clustering import AsyncFrontierClustering, FrontierClusterCache
+
+# Log-odds occupancy is kept in int8 fixed point, in units of 0.1. A hit
+# adds log(0.7 / 0.3), a free-space miss adds log(0.4 / 0.6), and the value
+# is clamped so that a cell can still flip after a few observations.
+LOG_ODDS_HIT = 8
+LOG_ODDS_MISS = -4
+LOG_ODDS_MIN = -20
+LOG_ODDS_MAX = 35
 
 class MapBuilder(object):
     def __init__(self, params):
@@ -26,25 +36,53 @@ class MapBuilder(object):
         self.visualize = params['visualize']
         self.obs_threshold = params['obs_threshold']
         self.num_maps = params['num_maps']
-
-        self.map = np.zeros((self.map_size_cm // self.resolution,
-                             self.map_size_cm // self.resolution,
-                             len(self.z_bins) + 1), dtype=np.float32)
+        self.cluster_cache = FrontierClusterCache(
+            params['clustering_algo'], params['recluster_threshold'])
+        # Clusters frontiers off the stepping thread, see clustering.py. The
+        # mapper runs inside the env worker processes, which cannot start
+        # processes of their own, so it always uses threads.
+        self.clustering_service = None
+        if params['async_clustering']:
+            self.clustering_service = AsyncFrontierClustering(
+                params['clustering_algo'], params['recluster_threshold'],
+                params['clustering_workers'])
+        self.log_odds_map = params['log_odds_map']
+        # Log-odds are only ever updated window by window.
+        self.incremental_map = params['incremental_map'] or self.log_odds_map
 
         self.agent_height = params['agent_height']
         self.agent_view_angle = params['agent_view_angle']
+        self.camera_projection = du.CameraProjection(
+            self.camera_matrix,
+            frame_height,
+            frame_width,
+            self.du_scale,
+            self.agent_height,
+            self.agent_view_angle)
+
+        self.frontier_kernel = np.zeros((3, 3), dtype=int)
+        self.frontier_kernel[1] = 1
+        self.frontier_kernel[:, 1] = 1
+
+        # Agent frame points (before the shift of update_map) at the cell
+        # centres of the egocentric projection, so that the log-odds map
+        # can be read back at those cells
+        cells = np.arange(self.vision_range) * self.resolution
+        self.view_points = np.zeros((self.vision_range, self.vision_range, 3))
+        self.view_points[:, :, 0] = \
+            cells[None, :] - self.vision_range * self.resolution // 2
+        self.view_points[:, :, 1] = cells[:, None]
+
+        self.reset_map(self.map_size_cm)
         return
 
     def update_map(self, depth, current_pose):  # depth image shape(256,256) values (95.0-250.0), max_value (at 111,81), [pose_x_cm, pose_y_cm, ori_deg] = 1280.0,1280.0,0.0
+        self.num_updates += 1
         with np.errstate(invalid="ignore"):
             depth[depth > self.vision_range * self.resolution] = np.NaN  # 64 blocks * 5cm/map_block = 320 cm.
-        point_cloud = du.get_point_cloud_from_z(depth, self.camera_matrix, \
-                                                scale=self.du_scale)
 
-        #  3D point cloud adjusted for camera view
-        agent_view = du.transform_camera_view(point_cloud,
-                                              self.agent_height,  # 1.25m
-                                              self.agent_view_angle)  # 0
+        #  3D point cloud adjusted for camera view, 1.25m high and 0 elevation
+        agent_view = self.camera_projection.get_point_cloud(depth)
 
         #  3D point cloud adjusted for position
         shift_loc = [self.vision_range * self.resolution // 2, 0, np.pi / 2.0]  # [160, 0, pi/2 = 90 deg]
@@ -71,13 +109,49 @@ class MapBuilder(object):
 
         geocentric_pc = du.transform_pose(agent_view, current_pose)
 
+        if self.incremental_map:
+            map_gt, explored_gt, new_explored, contour = \
+                self._update_map_window(geocentric_pc, current_pose)
+        else:
+            map_gt, explored_gt, new_explored, contour = \
+                self._update_map_full(geocentric_pc)
+
+        if self.log_odds_map:
+            # fp_proj is read off the updated log-odds map over the cells
+            # this frame observed, so that it agrees with map_gt
+            agent_view_cropped = self._get_log_odds_view(current_pose) * \
+                agent_view_explored
+
+        if self.num_maps == 5:
+            frontier_clusters = self.empty_clusters
+        else:
+            # The incremental mapper already tracks the frontier cells
+            points = self.frontier_tracker.indices if self.incremental_map \
+                else np.flatnonzero(contour)
+            num_frontier_points = len(points)
+            if num_frontier_points < 5:
+                print(f"ONLY {num_frontier_points} FRONTIER POINTS, SO NOT ENOUGH FOR CLUSTERING")
+                frontier_clusters = self.empty_clusters
+            elif self.clustering_service is not None:
+                self.clustering_service.submit(0, contour, self.num_updates,
+                                               points)
+                _, frontier_clusters = self.clustering_service.get(0)
+                if frontier_clusters is None:
+                    frontier_clusters = self.empty_clusters
+            else:
+                frontier_clusters = self.cluster_cache.cluster(contour, points)
+
+        return agent_view_cropped, map_gt, agent_view_explored, explored_gt, new_explored, contour, frontier_clusters
+
+    def _update_map_full(self, geocentric_pc):
+        self.changed_window = [0, self.map.shape[0], 0, self.map.shape[1]]
         geocentric_flat = du.bin_points(
             geocentric_pc,
             self.map.shape[0],
             self.z_bins,
             self.resolution)
 
-        self.map = self.map + geocentric_flat 
+        accumulate_counts(self.map, geocentric_flat)
 
         map_gt = self.map[:, :, 1] / self.obs_threshold  # (=1), map_gt = occupancy map
         map_gt[map_gt >= 0.5] = 1.0
@@ -88,23 +162,116 @@ class MapBuilder(object):
         new_explored = geocentric_flat.sum(2)
         new_explored[new_explored > 1] = 1.0
 
-        k = np.zeros((3,3),dtype=int)
-        k[1] = 1
-        k[:,1] = 1
-        contour = binary_dilation(explored_gt==0, k) & (explored_gt==1)
-        contour = contour & (binary_dilation(map_gt, k)==0)
+        contour = binary_dilation(explored_gt==0, self.frontier_kernel) & (explored_gt==1)
+        contour = contour & (binary_dilation(map_gt, self.frontier_kernel)==0)
         contour = morphology.remove_small_objects(contour, 2)
-        
-        num_frontier_points = len(np.nonzero(contour)[0])
-        if self.num_maps == 5:
-            frontier_clusters = np.zeros(np.shape(contour))
-        elif num_frontier_points < 5:
-            print(f"ONLY {num_frontier_points} FRONTIER POINTS, SO NOT ENOUGH FOR CLUSTERING")
-            frontier_clusters = np.zeros(np.shape(contour))
+
+        return map_gt, explored_gt, new_explored, contour.astype(float)
+
+    def _update_map_window(self, geocentric_pc, current_pose):
+        # Only the bounding box of the new points changes, so the counts are
+        # accumulated in place and the derived layers are kept as persistent
+        # buffers that are only rewritten inside that window. The returned
+        # maps are these buffers, valid until the next call.
+        self.new_explored[self.new_window] = 0
+
+        geocentric_flat, window = du.bin_points_window(
+            geocentric_pc,
+            self.map.shape[0],
+            self.z_bins,
+            self.resolution)
+
+        if self.log_odds_map:
+            free, geocentric_flat, window = self._get_free_cells(
+                geocentric_pc, current_pose, geocentric_flat, window)
+
+        if window is None:
+            self.new_window = np.s_[0:0, 0:0]
+            self.changed_window = [0, 0, 0, 0]
+            return self.map_gt, self.explored_gt, self.new_explored, \
+                self.frontier
+
+        y1, y2, x1, x2 = window
+        self.new_window = np.s_[y1:y2, x1:x2]
+
+        local_map = self.map[y1:y2, x1:x2]
+        accumulate_counts(local_map, geocentric_flat)
+        self.map[y1:y2, x1:x2] = local_map
+
+        if self.log_odds_map:
+            # Hit and miss evidence are added in one pass over the window,
+            # and occupancy and explored are read off the clamped result.
+            hit = geocentric_flat[:, :, 1] / self.obs_threshold >= 0.5
+            miss = free & np.logical_not(hit)
+            log_odds = self.log_odds[y1:y2, x1:x2].astype(np.int16)
+            log_odds += LOG_ODDS_HIT * hit + LOG_ODDS_MISS * miss
+            np.clip(log_odds, LOG_ODDS_MIN, LOG_ODDS_MAX, out=log_odds)
+            self.log_odds[y1:y2, x1:x2] = log_odds
+            self.map_gt[y1:y2, x1:x2] = log_odds > 0
+            new_explored = (geocentric_flat.sum(2) > 0) | free
+            self.explored_gt[y1:y2, x1:x2] = \
+                (self.explored_gt[y1:y2, x1:x2] > 0) | new_explored
+            self.new_explored[y1:y2, x1:x2] = new_explored
         else:
-            frontier_clusters = frontier_clustering(contour, step=0, algo="AGNES", metric=None, save_freq=None)
+            self.map_gt[y1:y2, x1:x2] = \
+                local_map[:, :, 1] / self.obs_threshold >= 0.5
+            self.explored_gt[y1:y2, x1:x2] = local_map.sum(2) > 0
+            self.new_explored[y1:y2, x1:x2] = geocentric_flat.sum(2) > 0
+
+        self.frontier_tracker.update(self.explored_gt, self.map_gt,
+                                     window=window)
+        self.changed_window = self.frontier_tracker.window
 
-        return agent_view_cropped, map_gt, agent_view_explored, explored_gt, new_explored, contour.astype(float), frontier_clusters
+        return self.map_gt, self.explored_gt, self.new_explored, self.frontier
+
+    def _get_free_cells(self, geocentric_pc, current_pose, geocentric_flat,
+                        window):
+        # Returns the cells crossed by free-space rays as a mask over the
+        # union of their bounding box and the points' window, with the point
+        # counts moved into that same window.
+        size = self.map.shape[0]
+        xs, ys = du.get_free_space_points(
+            geocentric_pc, current_pose[:2], self.z_bins,
+            self.vision_range * self.resolution, self.resolution / 2.)
+        X_bin = np.round(xs / self.resolution).astype(np.int32)
+        Y_bin = np.round(ys / self.resolution).astype(np.int32)
+        isvalid = (X_bin >= 0) & (X_bin < size) & (Y_bin >= 0) & (Y_bin < size)
+        X_bin, Y_bin = X_bin[isvalid], Y_bin[isvalid]
+
+        if X_bin.size == 0:
+            free = None if window is None else \
+                np.zeros(geocentric_flat.shape[:2], dtype=bool)
+            return free, geocentric_flat, window
+
+        free_window = [Y_bin.min(), Y_bin.max() + 1, X_bin.min(), X_bin.max() + 1]
+        if window is None:
+            y1, y2, x1, x2 = free_window
+            flat = np.zeros((y2 - y1, x2 - x1, len(self.z_bins) + 1),
+                            dtype=np.int64)
+        else:
+            y1, x1 = min(window[0], free_window[0]), min(window[2], free_window[2])
+            y2, x2 = max(window[1], free_window[1]), max(window[3], free_window[3])
+            flat = np.zeros((y2 - y1, x2 - x1, geocentric_flat.shape[2]),
+                            dtype=geocentric_flat.dtype)
+            flat[window[0] - y1:window[1] - y1,
+                 window[2] - x1:window[3] - x1] = geocentric_flat
+
+        free = np.zeros((y2 - y1, x2 - x1), dtype=bool)
+        free[Y_bin - y1, X_bin - x1] = True
+        return free, flat, [int(y1), int(y2), int(x1), int(x2)]
+
+    def _get_log_odds_view(self, current_pose):
+        # Occupancy of the log-odds map at the cells of the egocentric
+        # projection, 0 outside the map
+        size = self.map.shape[0]
+        geocentric = du.transform_pose(self.view_points, current_pose)
+        X_bin = np.round(geocentric[:, :, 0] / self.resolution).astype(np.int32)
+        Y_bin = np.round(geocentric[:, :, 1] / self.resolution).astype(np.int32)
+        isvalid = (X_bin >= 0) & (X_bin < size) & (Y_bin >= 0) & (Y_bin < size)
+
+        view = np.zeros(X_bin.shape)
+        view[isvalid] = self.log_odds[Y_bin[isvalid], X_bin[isvalid]] > 0
+        return view
 
     def get_st_pose(self, current_loc):
         loc = [- (current_loc[0] / self.resolution
@@ -116,12 +283,38 @@ class MapBuilder(object):
                90 - np.rad2deg(current_loc[2])]
         return loc
 
+    def close(self):
+        if self.clustering_service is not None:
+            self.clustering_service.close()
+
     def reset_map(self, map_size):
         self.map_size_cm = map_size
+        self.cluster_cache.reset()
+        if self.clustering_service is not None:
+            self.clustering_service.reset(0)
+        self.num_updates = 0
+        # Map cells [x1, x2, y1, y2] changed by the last update
+        size = self.map_size_cm // self.resolution
+        self.changed_window = [0, size, 0, size]
+        # Returned as frontier_clusters when there is nothing to cluster,
+        # instead of allocating a new map each step
+        self.empty_clusters = np.zeros((size, size))
 
         self.map = np.zeros((self.map_size_cm // self.resolution,
                              self.map_size_cm // self.resolution,
-                             len(self.z_bins) + 1), dtype=np.float32)
+                             len(self.z_bins) + 1), dtype=COUNT_DTYPE)
+
+        if self.incremental_map:
+            map_shape = self.map.shape[:2]
+            self.map_gt = np.zeros(map_shape, dtype=np.uint8)
+            self.explored_gt = np.zeros(map_shape, dtype=np.uint8)
+            self.new_explored = np.zeros(map_shape, dtype=np.uint8)
+            self.frontier = np.zeros(map_shape, dtype=np.uint8)
+            if self.log_odds_map:
+                self.log_odds = np.zeros(map_shape, dtype=np.int8)
+            self.frontier_tracker = FrontierTracker(
+                map_shape, self.frontier_kernel, frontier_map=self.frontier)
+            self.new_window = np.s_[0:0, 0:0]
 
     def get_map(self):
         return self.map
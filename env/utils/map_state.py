@@ -0,0 +1,33 @@
+import numpy as np
+
+# Hit counts per map cell only matter up to the occupancy and explored
+# thresholds, so they are stored as saturating 16-bit integers.
+COUNT_DTYPE = np.uint16
+
+
+def accumulate_counts(counts, new_counts):
+    """Adds new_counts to the integer array counts in place, saturating at
+    the largest value of its dtype instead of wrapping around."""
+    headroom = np.iinfo(counts.dtype).max - counts
+    counts += np.minimum(new_counts, headroom).astype(counts.dtype)
+    return counts
+
+
+class PackedMap(object):
+    """A binary map layer stored bit-packed, 1 bit per cell.
+
+    It is what the envs put in info for the trainer, and is only expanded
+    back to a float array when it reaches the policy, through np.asarray.
+    """
+
+    def __init__(self, binary_map):
+        self.shape = binary_map.shape
+        self.bits = np.packbits(np.asarray(binary_map) > 0, axis=None)
+
+    def unpack(self, dtype=np.float32):
+        size = int(np.prod(self.shape))
+        binary_map = np.unpackbits(self.bits, count=size).reshape(self.shape)
+        return binary_map.astype(dtype)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.unpack(np.float32 if dtype is None else dtype)
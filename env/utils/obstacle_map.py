@@ -0,0 +1,63 @@
+import numpy as np
+import skimage.morphology
+
+
+class InflatedObstacleMap(object):
+    """
+    Obstacle map dilated by the footprint selem, the map the planners read
+    traversibility from (traversible = map != True). update() diffs the
+    obstacle map against the previous one and only dilates again around the
+    cells that changed, so it costs nothing more than the diff while the
+    obstacles are static. version counts the updates that changed the map.
+    """
+
+    def __init__(self, selem, shape=None):
+        self.selem = selem
+        self.radius = max(selem.shape) // 2
+        self.reset(shape)
+
+    def reset(self, shape=None):
+        self.shape = None if shape is None else tuple(shape)
+        self.map = None if shape is None else np.zeros(shape, dtype=bool)
+        self.obstacle = None if shape is None else \
+            np.zeros(shape, dtype=bool)
+        self.version = 0
+
+    def update(self, obstacle, window=None):
+        """Updates the inflated map from obstacle (non-zero cells are
+        occupied) and returns it. window [x1, x2, y1, y2] bounds the cells
+        that may have changed, by default found by diffing."""
+        obstacle = np.asarray(obstacle) != 0
+        if self.obstacle is None or obstacle.shape != self.shape:
+            self.shape = obstacle.shape
+            self.obstacle = obstacle
+            self.map = skimage.morphology.binary_dilation(obstacle,
+                                                          self.selem)
+            self.version += 1
+            return self.map
+
+        if window is None:
+            changed = obstacle != self.obstacle
+            rows = np.flatnonzero(changed.any(1))
+            if rows.size == 0:
+                return self.map
+            cols = np.flatnonzero(changed.any(0))
+            window = [rows[0], rows[-1] + 1, cols[0], cols[-1] + 1]
+
+        # A change reaches radius cells away, and the dilated value of
+        # those cells depends on the obstacles radius cells further
+        h, w = self.shape
+        x1, x2, y1, y2 = window
+        r = self.radius
+        wx1, wx2, wy1, wy2 = max(0, x1 - r), min(h, x2 + r), \
+            max(0, y1 - r), min(w, y2 + r)
+        ox1, ox2, oy1, oy2 = max(0, x1 - 2 * r), min(h, x2 + 2 * r), \
+            max(0, y1 - 2 * r), min(w, y2 + 2 * r)
+
+        dilated = skimage.morphology.binary_dilation(
+            obstacle[ox1:ox2, oy1:oy2], self.selem)
+        self.map[wx1:wx2, wy1:wy2] = \
+            dilated[wx1 - ox1:wx2 - ox1, wy1 - oy1:wy2 - oy1]
+        self.obstacle[x1:x2, y1:y2] = obstacle[x1:x2, y1:y2]
+        self.version += 1
+        return self.map
@@ -0,0 +1,212 @@
+import heapq
+import math
+
+import cv2
+import numpy as np
+from scipy import ndimage
+from scipy.ndimage.morphology import binary_dilation
+
+from env.utils.fmm_planner import FMMPlanner
+
+SQRT2 = math.sqrt(2.)
+
+
+def astar(traversible, start, goal):
+    """
+    Shortest 8-connected path from start to goal [row, col] on the
+    traversible map, without cutting the corners of obstacles, searched
+    with A* and the octile heuristic. The search stops as soon as the goal
+    is reached, so it only visits the cells around the path.
+
+    Returns (path, g): the list of cells from start to goal, or None if
+    there is none, and the dict of the path cost of every cell visited.
+    """
+    h, w = traversible.shape
+    free = traversible.ravel()
+    start_i = int(start[0]) * w + int(start[1])
+    goal_r, goal_c = int(goal[0]), int(goal[1])
+    goal_i = goal_r * w + goal_c
+
+    def heuristic(i):
+        dr, dc = abs(i // w - goal_r), abs(i % w - goal_c)
+        return max(dr, dc) + (SQRT2 - 1.) * min(dr, dc)
+
+    g = {start_i: 0.}
+    parent = {start_i: -1}
+    heap = [(heuristic(start_i), start_i)]
+    closed = set()
+    while heap:
+        _, i = heapq.heappop(heap)
+        if i in closed:
+            continue
+        if i == goal_i:
+            path = []
+            while i >= 0:
+                path.append((i // w, i % w))
+                i = parent[i]
+            return path[::-1], g
+        closed.add(i)
+
+        r, c = divmod(i, w)
+        up, down, left, right = r > 0 and free[i - w], \
+            r + 1 < h and free[i + w], c > 0 and free[i - 1], \
+            c + 1 < w and free[i + 1]
+        for j, ok, cost in ((i - w, up, 1.), (i + w, down, 1.),
+                            (i - 1, left, 1.), (i + 1, right, 1.),
+                            (i - w - 1, up and left, SQRT2),
+                            (i - w + 1, up and right, SQRT2),
+                            (i + w - 1, down and left, SQRT2),
+                            (i + w + 1, down and right, SQRT2)):
+            if ok and (cost == 1. or free[j]) and j not in closed:
+                new_g = g[i] + cost
+                if new_g < g.get(j, np.inf):
+                    g[j] = new_g
+                    parent[j] = i
+                    heapq.heappush(heap, (new_g + heuristic(j), j))
+    return None, g
+
+
+class AStarPlanner(object):
+    """
+    Drop-in replacement of FMMPlanner (same constructor, set_goal and
+    get_short_term_goal) that searches a path with A* from the agent at
+    each call instead of computing the distance field of the whole grid.
+    The short-term goal is the last cell of the path within step_size of
+    the agent.
+
+    cache, cache_key and changed_window are accepted for compatibility with
+    FMMPlanner and ignored: the search is rooted at the agent, so there is
+    no goal-rooted distance field to reuse.
+    """
+
+    def __init__(self, traversible, num_rots, scale=1, step_size=5,
+                 cache=None, cache_key=None, changed_window=None):
+        self.scale = scale
+        self.step_size = step_size
+        if scale != 1.:
+            self.traversible = cv2.resize(traversible,
+                                          (traversible.shape[1] // scale, traversible.shape[0] // scale),
+                                          interpolation=cv2.INTER_NEAREST)
+            self.traversible = np.rint(self.traversible)
+        else:
+            self.traversible = traversible
+        self.traversible = np.array(self.traversible, dtype=bool)
+        self.num_rots = num_rots
+        self.goal = None
+        self.path = None
+        self.path_index = {}
+        self.g = {}
+        self.dist = None
+        self.dist_box = None
+
+    def set_goal(self, goal):
+        """goal is [col, row], as for FMMPlanner.set_goal. Returns the mask
+        of the cells the goal can be reached from, as FMMPlanner.set_goal:
+        its 4-connected component, since diagonal steps do not cut corners.
+        The path itself is only searched by get_short_term_goal."""
+        goal_x, goal_y = int(goal[0] / (self.scale * 1.)), \
+                         int(goal[1] / (self.scale * 1.))
+        self.goal = (goal_y, goal_x)
+        self.traversible[goal_y, goal_x] = True
+        self.path = None
+        labels, _ = ndimage.label(self.traversible)
+        return labels == labels[goal_y, goal_x]
+
+    def _search(self, start):
+        return astar(self.traversible, start, self.goal)
+
+    def get_dist(self):
+        """Path costs of the cells visited by the last search, in the place
+        of FMMPlanner.fmm_dist, over their bounding box dist_box
+        [r1, r2, c1, c2] only. The other cells of the box are set to the
+        largest cost + 1."""
+        if self.dist is None:
+            cells = np.fromiter(self.g.keys(), dtype=np.int64,
+                                count=len(self.g))
+            costs = np.fromiter(self.g.values(), dtype=float,
+                                count=len(self.g))
+            rows, cols = np.divmod(cells, self.traversible.shape[1])
+            r1, c1 = rows.min(), cols.min()
+            self.dist_box = [r1, rows.max() + 1, c1, cols.max() + 1]
+            self.dist = np.full((self.dist_box[1] - r1,
+                                 self.dist_box[3] - c1), costs.max() + 1.)
+            self.dist[rows - r1, cols - c1] = costs
+        return self.dist
+
+    def get_short_term_goal(self, state):
+        scale = self.scale * 1.
+        state = [int(x / scale) for x in state]
+        start = (min(max(state[0], 0), self.traversible.shape[0] - 1),
+                 min(max(state[1], 0), self.traversible.shape[1] - 1))
+
+        # Reuse the path of the previous call while the agent is on it
+        if self.path is not None and start in self.path_index:
+            path = self.path[self.path_index[start]:]
+        else:
+            path, self.g = self._search(start)
+            self.dist = None
+            self.path = path
+            self.path_index = {} if path is None else \
+                {cell: k for k, cell in enumerate(path)}
+
+        # No path, or already at the goal, which needs no replan
+        if path is None or len(path) < 2:
+            return start[0] * scale + 0.5, start[1] * scale + 0.5, \
+                path is None, self.get_dist()
+
+        stg = path[1]
+        for cell in path[1:]:
+            if (cell[0] - start[0]) ** 2 + (cell[1] - start[1]) ** 2 > \
+                    (self.step_size / scale) ** 2:
+                break
+            stg = cell
+        return stg[0] * scale + 0.5, stg[1] * scale + 0.5, False, \
+            self.get_dist()
+
+
+class MultiResolutionPlanner(AStarPlanner):
+    """
+    AStarPlanner that first searches a path on the map max-pooled by
+    factor, where a block is free if any of its cells is, and then
+    searches the full resolution path only inside the blocks around the
+    coarse path. Falls back to the full resolution search if the corridor
+    holds no path.
+    """
+
+    factor = 4
+
+    def _search(self, start):
+        f = self.factor
+        h, w = self.traversible.shape
+        ch, cw = -(-h // f), -(-w // f)
+        padded = np.zeros((ch * f, cw * f), dtype=bool)
+        padded[:h, :w] = self.traversible
+        coarse = padded.reshape(ch, f, cw, f).any(axis=(1, 3))
+
+        coarse_path, _ = astar(coarse, (start[0] // f, start[1] // f),
+                               (self.goal[0] // f, self.goal[1] // f))
+        if coarse_path is not None:
+            corridor = np.zeros((ch, cw), dtype=bool)
+            rows, cols = zip(*coarse_path)
+            corridor[list(rows), list(cols)] = True
+            corridor = binary_dilation(corridor, np.ones((3, 3)))
+            corridor = np.repeat(np.repeat(corridor, f, 0), f, 1)[:h, :w]
+            path, g = astar(self.traversible & corridor, start, self.goal)
+            if path is not None:
+                return path, g
+        return astar(self.traversible, start, self.goal)
+
+
+PLANNERS = {
+    'fmm': FMMPlanner,
+    'astar': AStarPlanner,
+    'multires': MultiResolutionPlanner,
+}
+
+
+def get_planner(name):
+    """Planner class of a --planner name: fmm | astar | multires"""
+    if name not in PLANNERS:
+        raise ValueError("Unknown planner {}, expected one of {}".format(
+            name, sorted(PLANNERS)))
+    return PLANNERS[name]
@@ -47,14 +47,13 @@ from utils.local_sweep_storage import GlobalRolloutStorage #, FIFOMemory
 
 from algo import local_sweep_ppo
 from local_sweep_model import RL_Policy
-from clustering import frontier_clustering
+from clustering import AsyncFrontierClustering, FrontierClusterCache
 
 import sys
 import matplotlib
 import time
 
-from scipy.ndimage.morphology import binary_dilation
-from skimage import morphology
+from env.utils.frontier import compute_frontier_map, make_frontier_tracker
 
 if sys.platform == 'darwin':
     matplotlib.use("tkagg")
@@ -72,19 +71,15 @@ if args.cuda:
     torch.cuda.manual_seed(args.seed)
 
 #This function is called after every macro completes, in order to update the frontier map. The maps are moved to the cpu for the computations.
-def get_frontier_map(map_gt, explored_gt, visited_gt, bad_frontier_map):
+def get_frontier_map(map_gt, explored_gt, visited_gt, bad_frontier_map,
+                     tracker=None):
     
     map_gt = map_gt.detach().cpu().numpy() # obstacle map
     explored_gt = explored_gt.detach().cpu().numpy() # explored map
     visited_gt = visited_gt.detach().cpu().numpy() # visited/trajectory map
 
-    selem = morphology.disk(5) # 5 is the radius of the flat, disk-shaped footprint
-    # binary dilation expands the non-zero values of an image by the structuring element (selem) as its center passes through the non-zero elements
-    contour = binary_dilation(explored_gt==0, selem) & (explored_gt==1) # frontier points (dilated by selem)
-    contour = contour & (binary_dilation(map_gt, selem)==0) # same as above, but removing points near obstacles with selem
-    contour = contour & (binary_dilation(visited_gt, morphology.disk(1))==0) # removing points previously visited with disc(rad=1)
-    contour = contour & (binary_dilation(bad_frontier_map, morphology.disk(1))==0) # removing points in the bad frontier map (the current goal point).
-    contour = morphology.remove_small_objects(contour, 2) # removing clusters (square connectivity) of size less than 2
+    contour = compute_frontier_map(map_gt, explored_gt, visited_gt,
+                                   bad_frontier_map, tracker)
 
     map_gt = torch.from_numpy(map_gt).float().to(args.device)
     explored_gt = torch.from_numpy(explored_gt).float().to(args.device)
@@ -197,6 +192,17 @@ def main():
     full_map = torch.zeros(num_scenes, num_maps, full_w, full_h).float().to(device) 
     local_map = torch.zeros(num_scenes, num_maps, local_w, local_h).float().to(device)
     bad_frontier_map = np.zeros((num_scenes, 1, local_w, local_h)) # the current goal frontier point
+    frontier_trackers = [make_frontier_tracker((local_w, local_h))
+                         for e in range(num_scenes)]
+    cluster_caches = [FrontierClusterCache(args.frontier_clustering,
+                                           args.recluster_threshold)
+                      for e in range(num_scenes)]
+    clustering_service = None
+    if args.async_clustering:
+        clustering_service = AsyncFrontierClustering(
+            args.frontier_clustering, args.recluster_threshold,
+            args.clustering_workers,
+            use_processes=args.async_clustering == 2)
 
     # Initial full and local pose
     full_pose = torch.zeros(num_scenes, 3).float().to(device) #(x,y,o)
@@ -215,6 +221,13 @@ def main():
     def init_map_and_pose():
         full_map.fill_(0.)
         bad_frontier_map.fill(0.)
+        for tracker in frontier_trackers:
+            tracker.reset()
+        for cache in cluster_caches:
+            cache.reset()
+        if clustering_service is not None:
+            for e in range(num_scenes):
+                clustering_service.reset(e)
         full_pose.fill_(0.)
         full_pose[:, :2] = args.map_size_cm / 100.0 / 2.0 # map_size half-breadth = 12.8m (x,y), middle of the full area in m.
 
@@ -441,15 +454,21 @@ def main():
             for e in range(num_scenes):
                 global_orientation[e] = int((locs[e, 2] + 180.0) / 5.)
                 local_map[e, 4] = get_frontier_map(local_map[e, 0, :, :].detach(), \
-                    local_map[e, 1, :, :].detach(), local_map[e, 3, :, :].detach(), bad_frontier_map[e,0,:,:])
+                    local_map[e, 1, :, :].detach(), local_map[e, 3, :, :].detach(), bad_frontier_map[e,0,:,:],
+                    frontier_trackers[e])
                 if num_maps >= 6:
                     frontier_map = local_map[e, 4, :, :].detach().cpu().numpy()
-                    num_frontier_points = len(np.nonzero(frontier_map)[0])
+                    num_frontier_points = len(frontier_trackers[e].get_points()[0])
                     if num_frontier_points < 5:
                         print(f"ONLY {num_frontier_points} FRONTIER POINTS, SO NOT ENOUGH FOR CLUSTERING")
                         frontier_clusters = np.zeros(np.shape(frontier_map))
+                    elif clustering_service is not None:
+                        clustering_service.submit(e, frontier_map, total_num_steps)
+                        _, frontier_clusters = clustering_service.get(e)
+                        if frontier_clusters is None:
+                            frontier_clusters = np.zeros(np.shape(frontier_map))
                     else:
-                        frontier_clusters = frontier_clustering(frontier_map, step=0, algo="AGNES", metric=None, save_freq=None)
+                        frontier_clusters = cluster_caches[e].cluster(frontier_map)
                     local_map[e, 5] = torch.from_numpy(frontier_clusters.astype(float)).float().to(device)
             global_input = local_map
                 
@@ -673,7 +692,11 @@ def main():
 
         print(log)
         logging.info(log)
-    
+
+    if clustering_service is not None:
+        clustering_service.close()
+    envs.close()
+
     end = time.time()
     time_elapsed = time.gmtime(end - start)
     print_time = time.strftime("%Hh %Mm %Ss", time_elapsed)
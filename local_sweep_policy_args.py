@@ -176,6 +176,42 @@ def get_args():
     parser.add_argument('-ot', '--obs_threshold', type=float, default=1)
     parser.add_argument('-ct', '--collision_threshold', type=float, default=0.20)
     parser.add_argument('-nl', '--noise_level', type=float, default=1.0)
+    parser.add_argument('--incremental_map', type=int, default=1,
+                        help="""1: update the mapper only inside the window
+                                touched by each frame (default: 1)""")
+    parser.add_argument('--log_odds_map', type=int, default=0,
+                        help="""1: build the occupancy map from log-odds hit
+                                and free-space evidence instead of thresholded
+                                hit counts. Slower per frame, as the
+                                free-space rays are also cast (default: 0)""")
+    parser.add_argument('--frontier_clustering', type=str, default="AGNES",
+                        help="""algorithm used to cluster frontier points:
+                                AGNES | CC, the near-linear connected
+                                components clustering (default: AGNES)""")
+    parser.add_argument('--recluster_threshold', type=float, default=0.,
+                        help="""fraction of frontier points that may change
+                                before the frontier is clustered again from
+                                scratch, smaller changes only reassign the
+                                changed points, 0: recluster on any change
+                                (default: 0)""")
+    parser.add_argument('--async_clustering', type=int, default=0,
+                        help="""0: cluster frontiers synchronously, 1: on a
+                                thread pool, 2: on a process pool (threads
+                                in the env mappers), using the latest
+                                completed result (default: 0)""")
+    parser.add_argument('--clustering_workers', type=int, default=1)
+    parser.add_argument('--frontier_scoring', type=int, default=0,
+                        help="""1: on a goal change, replace the goal with the
+                                best frontier cluster by information gain over
+                                geodesic distance from the agent (default: 0)""")
+    parser.add_argument('--windowed_planning', type=int, default=0,
+                        help="""1: plan inside a box around the start and the
+                                goal, grown on failure up to the whole local
+                                map, 0: always plan over the whole local map
+                                (default: 0)""")
+    parser.add_argument('--planner', type=str, default="fmm",
+                        help="""planner backend of the ground truth actions:
+                                fmm | astar | multires (default: fmm)""")
 
     # parse arguments
     args = parser.parse_args()
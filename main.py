@@ -26,8 +26,8 @@ import sys
 import matplotlib
 import time
 
-from scipy.ndimage.morphology import binary_dilation
-from skimage import morphology
+from env.utils.frontier import NearestFrontierIndex, \
+    compute_frontier_map, make_frontier_tracker
 
 if sys.platform == 'darwin':
     matplotlib.use("tkagg")
@@ -44,19 +44,15 @@ if args.cuda:
     torch.cuda.manual_seed(args.seed)
 
 
-def get_frontier_map(map_gt, explored_gt, visited_gt, bad_frontier_map):
+def get_frontier_map(map_gt, explored_gt, visited_gt, bad_frontier_map,
+                     tracker=None):
 
     map_gt = map_gt.detach().cpu().numpy()
     explored_gt = explored_gt.detach().cpu().numpy()
     visited_gt = visited_gt.detach().cpu().numpy()
 
-    selem = morphology.disk(5)
-
-    contour = binary_dilation(explored_gt==0, selem) & (explored_gt==1)
-    contour = contour & (binary_dilation(map_gt, selem)==0)
-    contour = contour & (binary_dilation(visited_gt, morphology.disk(1))==0)
-    contour = contour & (binary_dilation(bad_frontier_map, morphology.disk(1))==0)
-    contour = morphology.remove_small_objects(contour, 2)
+    contour = compute_frontier_map(map_gt, explored_gt, visited_gt,
+                                   bad_frontier_map, tracker)
     
     '''
     global counter
@@ -183,6 +179,9 @@ def main():
     full_map = torch.zeros(num_scenes, 5, full_w, full_h).float().to(device)
     local_map = torch.zeros(num_scenes, 5, local_w, local_h).float().to(device)
     bad_frontier_map = np.zeros((num_scenes, 1, local_w, local_h))
+    frontier_trackers = [make_frontier_tracker((local_w, local_h))
+                         for e in range(num_scenes)]
+    frontier_index = NearestFrontierIndex(num_scenes, (local_w, local_h))
 
     # Initial full and local pose
     full_pose = torch.zeros(num_scenes, 3).float().to(device)
@@ -202,6 +201,9 @@ def main():
     def init_map_and_pose():
         full_map.fill_(0.)
         bad_frontier_map.fill(0.)
+        for tracker in frontier_trackers:
+            tracker.reset()
+        frontier_index.reset()
         full_pose.fill_(0.)
         full_pose[:, :2] = args.map_size_cm / 100.0 / 2.0
 
@@ -228,6 +230,7 @@ def main():
             local_map[e] = full_map[e, :, lmb[e, 0]:lmb[e, 1], lmb[e, 2]:lmb[e, 3]]
             local_pose[e] = full_pose[e] - \
                             torch.from_numpy(origins[e]).to(device).float()
+            frontier_index.update(e, np.nonzero(local_map[e, 4].cpu().numpy()))
 
     init_map_and_pose()
 
@@ -389,6 +392,18 @@ def main():
             # option RL dicision making
             #print("local_step_count_rot")
             #print(local_step_count_rot)
+            # New goals of the envs starting a navigation, snapped to their
+            # nearest frontier cells with one batched query
+            goal_envs = [e for e in range(num_scenes)
+                         if current_option[e] != 1 and local_step_count[e] == 0]
+            for e in goal_envs:
+                cpu_actions = nn.Sigmoid()(g_action[e,1:]).cpu().numpy()
+                global_goals[e] = [int(cpu_actions[0] * (local_w-1)), int(cpu_actions[1] * (local_h-1))]
+            new_frontier_goals = dict(zip(goal_envs, frontier_index.query_batch(
+                [global_goals[e] for e in goal_envs], goal_envs,
+                exclude=bad_frontier_map[:, 0])))
+
+            planner_inputs = [None] * num_scenes
             action = np.zeros(num_scenes)
             for e in range(num_scenes):
                 change_goal = False
@@ -422,27 +437,19 @@ def main():
 
                 else: #navigation
                     if local_step_count[e] == 0: #reset goal point after exploration
-                        cpu_actions = nn.Sigmoid()(g_action[e,1:]).cpu().numpy()
-                        global_goals[e] = [int(cpu_actions[0] * (local_w-1)), int(cpu_actions[1] * (local_h-1))]
                         #print("new goal points:")
                         #print(e)
                         #print(global_goals[e])
                         change_goal = True
 
-                        frontier_map = local_map[e, -1, :, :].detach().cpu().numpy()
-                        ind_r,ind_c = np.nonzero(frontier_map)
-                        if ind_r.size == 0 or ind_c.size == 0:
-                            ind_r,ind_c = np.array([int(planner_pose_inputs[e,1] * 100.0 / args.map_resolution)]),\
-                                          np.array([int(planner_pose_inputs[e,0] * 100.0 / args.map_resolution)])
-                        ind = np.stack((ind_r,ind_c),1)
-                        dist = ind - np.array(global_goals[e])
-                        dist = dist**2
-                        dist = np.sum(dist,1)
-                        f_ind = np.argmin(dist)
-                        frontier_goals[e] = [ind_r[f_ind],ind_c[f_ind]]
+                        frontier_goal = new_frontier_goals[e]
+                        if frontier_goal is None:
+                            frontier_goal = [int(planner_pose_inputs[e,1] * 100.0 / args.map_resolution),
+                                             int(planner_pose_inputs[e,0] * 100.0 / args.map_resolution)]
+                        frontier_goals[e] = frontier_goal
                         print("new frontier points for " + str(e))
-                        print((ind_r[f_ind],ind_c[f_ind]))
-                        bad_frontier_map[e,0,ind_r[f_ind],ind_c[f_ind]] = 1
+                        print(tuple(frontier_goal))
+                        bad_frontier_map[e,0,frontier_goal[0],frontier_goal[1]] = 1
                         local_step_count[e] = args.num_local_steps
                     
                     local_step_count[e] -= 1
@@ -453,22 +460,23 @@ def main():
                     #global_goals[e] = global_goals[e][0]
 
                     # Get short term goal
-                    planner_inputs = [{} for en in range(num_scenes)]
-                    for en, p_input in enumerate(planner_inputs):
-                        p_input['map_pred'] = local_map[en, 0, :, :].cpu().numpy()
-                        p_input['exp_pred'] = local_map[en, 1, :, :].cpu().numpy()
-                        p_input['pose_pred'] = planner_pose_inputs[en]
-                        p_input['goal'] = global_goals[e]#frontier_goals[e]
-                        p_input['goal_arbitrary'] = global_goals[e]
-                        p_input['change_goal'] = change_goal
-                        p_input['active'] = True if en==e else False
-
-                    output = envs.get_short_term_goal(planner_inputs)
-
-                    action_target = output[e, -1].long().to(device)
-                    action[e] = action_target.cpu()
-                    #if output[e,0] == True:
-                    #    local_step_count_nav[e] = 0
+                    planner_inputs[e] = {
+                        'map_pred': local_map[e, 0, :, :].cpu().numpy(),
+                        'exp_pred': local_map[e, 1, :, :].cpu().numpy(),
+                        'pose_pred': planner_pose_inputs[e],
+                        'goal': global_goals[e],
+                        'goal_arbitrary': global_goals[e],
+                        'change_goal': change_goal}
+
+            # Short term goals of all the navigating envs in one round trip
+            output = envs.get_short_term_goal_batch(planner_inputs)
+            for e in range(num_scenes):
+                if planner_inputs[e] is None:
+                    continue
+                action_target = output[e, -1].long().to(device)
+                action[e] = action_target.cpu()
+                #if output[e,0] == True:
+                #    local_step_count_nav[e] = 0
 
             print("Timer for phase 2")
             timer.toc()
@@ -565,7 +573,9 @@ def main():
                 for e in range(num_scenes):
                     global_orientation[e] = int((locs[e, 2] + 180.0) / 5.)
                     local_map[e, 4] = get_frontier_map(local_map[e, 0, :, :].detach(), \
-                        local_map[e, 1, :, :].detach(), local_map[e, 3, :, :].detach(), bad_frontier_map[e,0,:,:])
+                        local_map[e, 1, :, :].detach(), local_map[e, 3, :, :].detach(), bad_frontier_map[e,0,:,:],
+                        frontier_trackers[e])
+                    frontier_index.update(e, frontier_trackers[e].get_points())
 
                 global_input = local_map
                 #global_input[:, 4:, :, :] = \
@@ -810,6 +820,8 @@ def main():
         print(log)
         logging.info(log)
 
+    envs.close()
+
 
 if __name__ == "__main__":
     main()
@@ -23,14 +23,14 @@ from utils.storage import GlobalRolloutStorage #, FIFOMemory
 
 import algo
 from model import RL_Policy
-from clustering import frontier_clustering
+from clustering import AsyncFrontierClustering, FrontierClusterCache
 
 import sys
 import matplotlib
 import time
 
-from scipy.ndimage.morphology import binary_dilation
-from skimage import morphology
+from env.utils.frontier import NearestFrontierIndex, \
+    compute_frontier_map, make_frontier_tracker
 
 if sys.platform == 'darwin':
     matplotlib.use("tkagg")
@@ -47,19 +47,15 @@ if args.cuda:
     torch.cuda.manual_seed(args.seed)
 
 
-def get_frontier_map(map_gt, explored_gt, visited_gt, bad_frontier_map):
+def get_frontier_map(map_gt, explored_gt, visited_gt, bad_frontier_map,
+                     tracker=None):
 
     map_gt = map_gt.detach().cpu().numpy() # obstacle map
     explored_gt = explored_gt.detach().cpu().numpy() # explored map
     visited_gt = visited_gt.detach().cpu().numpy() # visited/trajectory map
 
-    selem = morphology.disk(5) # 5 is the radius of the flat, disk-shaped footprint
-    # binary dilation expands the non-zero values of an image by the structuring element (selem) as its center passes through the non-zero elements
-    contour = binary_dilation(explored_gt==0, selem) & (explored_gt==1) # frontier points (dilated by selem)
-    contour = contour & (binary_dilation(map_gt, selem)==0) # same as above, but removing points near obstacles with selem
-    contour = contour & (binary_dilation(visited_gt, morphology.disk(1))==0) # removing points previously visited with disc(rad=1)
-    contour = contour & (binary_dilation(bad_frontier_map, morphology.disk(1))==0) # removing points in the bad frontier map (the current goal point).
-    contour = morphology.remove_small_objects(contour, 2) # removing clusters (square connectivity) of size less than 2
+    contour = compute_frontier_map(map_gt, explored_gt, visited_gt,
+                                   bad_frontier_map, tracker)
     
     '''
     global counter
@@ -191,6 +187,18 @@ def main():
     full_map = torch.zeros(num_scenes, num_maps, full_w, full_h).float().to(device)
     local_map = torch.zeros(num_scenes, num_maps, local_w, local_h).float().to(device)
     bad_frontier_map = np.zeros((num_scenes, 1, local_w, local_h)) # the current goal frontier point
+    frontier_trackers = [make_frontier_tracker((local_w, local_h))
+                         for e in range(num_scenes)]
+    frontier_index = NearestFrontierIndex(num_scenes, (local_w, local_h))
+    cluster_caches = [FrontierClusterCache(args.frontier_clustering,
+                                           args.recluster_threshold)
+                      for e in range(num_scenes)]
+    clustering_service = None
+    if args.async_clustering:
+        clustering_service = AsyncFrontierClustering(
+            args.frontier_clustering, args.recluster_threshold,
+            args.clustering_workers,
+            use_processes=args.async_clustering == 2)
 
     # Initial full and local pose
     full_pose = torch.zeros(num_scenes, 3).float().to(device)
@@ -210,6 +218,14 @@ def main():
     def init_map_and_pose():
         full_map.fill_(0.)
         bad_frontier_map.fill(0.)
+        for tracker in frontier_trackers:
+            tracker.reset()
+        frontier_index.reset()
+        for cache in cluster_caches:
+            cache.reset()
+        if clustering_service is not None:
+            for e in range(num_scenes):
+                clustering_service.reset(e)
         full_pose.fill_(0.)
         full_pose[:, :2] = args.map_size_cm / 100.0 / 2.0 # map_size half-breadth = 12.8m (x,y)
 
@@ -236,6 +252,8 @@ def main():
             local_map[e] = full_map[e, :, lmb[e, 0]:lmb[e, 1], lmb[e, 2]:lmb[e, 3]]
             local_pose[e] = full_pose[e] - \
                             torch.from_numpy(origins[e]).to(device).float() # local_pose = full_pose since origins = 0.
+            frontier_index.update(e, np.nonzero(
+                local_map[e, 4 if num_maps == 5 else 5].cpu().numpy()))
 
     init_map_and_pose()
 
@@ -398,6 +416,18 @@ def main():
             # option RL decision making
             #print("local_step_count_rot")
             #print(local_step_count_rot)
+            # New goals of the envs starting a navigation, snapped to their
+            # nearest frontier cells with one batched query
+            goal_envs = [e for e in range(num_scenes)
+                         if current_option[e] != 1 and local_step_count[e] == 0]
+            for e in goal_envs:
+                cpu_actions = nn.Sigmoid()(g_action[e,1:]).cpu().numpy()
+                global_goals[e] = [int(cpu_actions[0] * (local_w-1)), int(cpu_actions[1] * (local_h-1))]
+            new_frontier_goals = dict(zip(goal_envs, frontier_index.query_batch(
+                [global_goals[e] for e in goal_envs], goal_envs,
+                exclude=bad_frontier_map[:, 0])))
+
+            planner_inputs = [None] * num_scenes
             action = np.zeros(num_scenes)
             for e in range(num_scenes):
                 change_goal = False
@@ -431,28 +461,18 @@ def main():
 
                 else: #navigation
                     if local_step_count[e] == 0: #reset step count for macro.
-                        cpu_actions = nn.Sigmoid()(g_action[e,1:]).cpu().numpy() # taking actions from gpu and putting on cpu after Sigmoid.
-                        global_goals[e] = [int(cpu_actions[0] * (local_w-1)), int(cpu_actions[1] * (local_h-1))] # [int(x * 511), int(y * 511)], i.e. action-goals as map co-ordinates.
                         #print("new goal points:")
                         #print(e)
                         #print(global_goals[e])
                         change_goal = True # True, if navigation. False, if look-around.
-                        if num_maps == 5:
-                            frontier_map = local_map[e, 4, :, :].detach().cpu().numpy() # frontier map taken to cpu for computations.
-                        else:
-                            frontier_map = local_map[e, 5, :, :].detach().cpu().numpy()
-                        ind_r,ind_c = np.nonzero(frontier_map) # finding indicies of non-zeros on the frontier map. 
-                        if ind_r.size == 0 or ind_c.size == 0: # if there are no frontiers in the frontier map:
-                            ind_r,ind_c = np.array([int(planner_pose_inputs[e,1] * 100.0 / args.map_resolution)]), np.array([int(planner_pose_inputs[e,0] * 100.0 / args.map_resolution)]) # the current timestep pose of the agent, updated each step from sensor info. 
-                        ind = np.stack((ind_r,ind_c),1) # ([87,256],[x2,y2],[x3,y3],...,etc.)
-                        dist = ind - np.array(global_goals[e]) # calculating the distances of the frontier points from the arbitrary goal from the policy.
-                        dist = dist**2
-                        dist = np.sum(dist,1) 
-                        f_ind = np.argmin(dist) # returning the action-goal indicies (x,y) that minimize the distance to the arbitrary goal.
-                        frontier_goals[e] = [ind_r[f_ind],ind_c[f_ind]] # setting these as the new frontier goals for each scene.
+                        frontier_goal = new_frontier_goals[e]
+                        if frontier_goal is None:
+                            frontier_goal = [int(planner_pose_inputs[e,1] * 100.0 / args.map_resolution),
+                                             int(planner_pose_inputs[e,0] * 100.0 / args.map_resolution)]
+                        frontier_goals[e] = frontier_goal
                         print("new frontier points for " + str(e))
-                        print((ind_r[f_ind],ind_c[f_ind]))
-                        bad_frontier_map[e,0,ind_r[f_ind],ind_c[f_ind]] = 1 # only the chosen frontier point goal is set as 1 in the bad frontier map.
+                        print(tuple(frontier_goal))
+                        bad_frontier_map[e,0,frontier_goal[0],frontier_goal[1]] = 1
                         local_step_count[e] = args.num_local_steps
                     
                     local_step_count[e] -= 1
@@ -463,22 +483,23 @@ def main():
                     #global_goals[e] = global_goals[e][0]
 
                     # Get short term goal
-                    planner_inputs = [{} for en in range(num_scenes)]
-                    for en, p_input in enumerate(planner_inputs):
-                        p_input['map_pred'] = local_map[en, 0, :, :].cpu().numpy() # occupancy map
-                        p_input['exp_pred'] = local_map[en, 1, :, :].cpu().numpy() # explored map
-                        p_input['pose_pred'] = planner_pose_inputs[en] # e.g. (2.4m 8.3m, 0.0m, 0, 512, 0, 512)
-                        p_input['goal'] = frontier_goals[e] # global_goals[e] # used for computing movement atoms by path planning.
-                        p_input['goal_arbitrary'] = global_goals[e] # only used for visualizations. how exactly?
-                        p_input['change_goal'] = change_goal
-                        p_input['active'] = True if en==e else False
-
-                    output = envs.get_short_term_goal(planner_inputs)
-
-                    action_target = output[e, -1].long().to(device) # putting the env short-term goal (action_target) on the gpu. action_target = (0:right, 1:left, 2:forward).
-                    action[e] = action_target.cpu() # putting action_targets also on cpu.
-                    #if output[e,0] == True:
-                    #    local_step_count_nav[e] = 0
+                    planner_inputs[e] = {
+                        'map_pred': local_map[e, 0, :, :].cpu().numpy(),
+                        'exp_pred': local_map[e, 1, :, :].cpu().numpy(),
+                        'pose_pred': planner_pose_inputs[e],
+                        'goal': frontier_goals[e],
+                        'goal_arbitrary': global_goals[e],
+                        'change_goal': change_goal}
+
+            # Short term goals of all the navigating envs in one round trip
+            output = envs.get_short_term_goal_batch(planner_inputs)
+            for e in range(num_scenes):
+                if planner_inputs[e] is None:
+                    continue
+                action_target = output[e, -1].long().to(device) # putting the env short-term goal (action_target) on the gpu. action_target = (0:right, 1:left, 2:forward).
+                action[e] = action_target.cpu() # putting action_targets also on cpu.
+                #if output[e,0] == True:
+                #    local_step_count_nav[e] = 0
 
             print("Timer for phase 2")
             timer.toc()
@@ -575,16 +596,25 @@ def main():
                 for e in range(num_scenes):
                     global_orientation[e] = int((locs[e, 2] + 180.0) / 5.)
                     local_map[e, 4] = get_frontier_map(local_map[e, 0, :, :].detach(), \
-                        local_map[e, 1, :, :].detach(), local_map[e, 3, :, :].detach(), bad_frontier_map[e,0,:,:])
+                        local_map[e, 1, :, :].detach(), local_map[e, 3, :, :].detach(), bad_frontier_map[e,0,:,:],
+                        frontier_trackers[e])
                     if num_maps >= 6:
                         frontier_map = local_map[e, 4, :, :].detach().cpu().numpy()
-                        num_frontier_points = len(np.nonzero(frontier_map)[0])
+                        num_frontier_points = len(frontier_trackers[e].get_points()[0])
                         if num_frontier_points < 5:
                             print(f"ONLY {num_frontier_points} FRONTIER POINTS, SO NOT ENOUGH FOR CLUSTERING")
                             frontier_clusters = np.zeros(np.shape(frontier_map))
+                        elif clustering_service is not None:
+                            clustering_service.submit(e, frontier_map, total_num_steps)
+                            _, frontier_clusters = clustering_service.get(e)
+                            if frontier_clusters is None:
+                                frontier_clusters = np.zeros(np.shape(frontier_map))
                         else:
-                            frontier_clusters = frontier_clustering(frontier_map, step=0, algo="AGNES", metric=None, save_freq=None)
+                            frontier_clusters = cluster_caches[e].cluster(frontier_map)
                         local_map[e, 5] = torch.from_numpy(frontier_clusters.astype(float)).float().to(device)
+                        frontier_index.update(e, np.nonzero(frontier_clusters))
+                    else:
+                        frontier_index.update(e, frontier_trackers[e].get_points())
                 global_input = local_map
                 #global_input[:, 4:, :, :] = \
                 #    nn.MaxPool2d(args.global_downscaling)(full_map)
@@ -844,6 +874,10 @@ def main():
         print(log)
         logging.info(log)
 
+    if clustering_service is not None:
+        clustering_service.close()
+    envs.close()
+
 
 if __name__ == "__main__":
     main()
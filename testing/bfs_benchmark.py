@@ -0,0 +1,118 @@
+"""Benchmark of the frontier distance search used by the frontier reward.
+
+Compares the path-copying search that env/utils/BFS.py used to implement,
+the flat queue search and the numpy wavefront search on full-size maps
+built by MapBuilder along a random trajectory, and checks that all of them
+return the same distance, e.g.
+
+    python testing/bfs_benchmark.py --map_size_cm 2400 --steps 200
+"""
+import argparse
+import os
+import sys
+import time
+from collections import deque
+
+import numpy as np
+from scipy.ndimage.morphology import binary_dilation
+from skimage import morphology
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from env.utils.BFS import bfs_queue, bfs_wavefront
+import mapping_benchmark as mb
+
+
+def bfs_path_copying(obstacle, explored, frontier, start):
+    """The previous implementation, which copies the path in every queue
+    entry."""
+    height, width = obstacle.shape
+    queue = deque([[start]])
+    seen = set([start])
+    while queue:
+        path = queue.popleft()
+        x, y = path[-1]
+        if frontier[x][y] == 1:
+            return len(path)
+        for x2, y2 in ((x+1,y), (x-1,y), (x,y+1), (x,y-1)):
+            if 0 <= x2 < width and 0 <= y2 < height and obstacle[x2][y2] == 0 and explored[x2][y2] == 1 and (x2, y2) not in seen:
+                queue.append(path + [(x2, y2)])
+                seen.add((x2, y2))
+    return 0
+
+
+def timed(fn, *args):
+    start = time.time()
+    result = fn(*args)
+    return result, (time.time() - start) * 1000.
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Frontier BFS benchmark')
+    parser.add_argument('--map_size_cm', type=int, default=2400)
+    parser.add_argument('--steps', type=int, default=200)
+    parser.add_argument('--every', type=int, default=20,
+                        help='search every this many steps')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    walls = mb.make_floorplan(args.map_size_cm, rng)
+    camera_matrix = mb.du.get_camera_matrix(mb.FRAME_SIZE, mb.FRAME_SIZE,
+                                            mb.HFOV)
+    mapper = mb.build_mapper('incremental', args.map_size_cm, 2, 64)
+    selem = morphology.disk(5)
+    dist = np.empty((mapper.map_size_cm // mapper.resolution,) * 2,
+                    dtype=np.int32)
+
+    print("{:>6} {:>8} {:>10} {:>10} {:>10} {:>10}".format(
+        'step', 'length', 'reached', 'path ms', 'queue ms', 'wave ms'))
+    totals = np.zeros(3)
+    for i, pose in enumerate(mb.make_trajectory(walls, args.steps, rng)):
+        depth = mb.render_depth(walls, pose, camera_matrix)
+        _, map_gt, _, explored_gt, _, _, _ = mapper.update_map(depth, pose)
+        if i % args.every != args.every - 1:
+            continue
+        obstacle = np.rint(map_gt)
+        explored = np.rint(explored_gt)
+        frontier = binary_dilation(explored == 0, selem) & (explored == 1)
+        frontier = frontier & (binary_dilation(obstacle == 1, selem) == 0)
+        # Search from the far end of the explored area so that the
+        # frontier is not next to the start
+        rows, cols = np.nonzero((explored == 1) & (obstacle == 0) & ~frontier)
+        if rows.size == 0:
+            continue
+        k = rng.randint(rows.size)
+        start = (int(rows[k]), int(cols[k]))
+
+        path_len, path_ms = timed(bfs_path_copying, obstacle, explored,
+                                  frontier, start)
+        queue_len, queue_ms = timed(bfs_queue, obstacle, explored, frontier,
+                                    start, dist)
+        wave_len, wave_ms = timed(bfs_wavefront, obstacle, explored,
+                                  frontier, start, dist)
+        assert path_len == queue_len == wave_len, \
+            (path_len, queue_len, wave_len)
+        totals += [path_ms, queue_ms, wave_ms]
+        print("{:>6} {:>8} {:>10} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+            i + 1, wave_len, int((dist >= 0).sum()), path_ms, queue_ms,
+            wave_ms))
+
+    # Worst case: no frontier, every explored free cell is visited
+    size = dist.shape[0]
+    obstacle = np.zeros((size, size))
+    explored = np.ones((size, size))
+    frontier = np.zeros((size, size))
+    frontier[-1, -1] = 1
+    start = (0, 0)
+    path_len, path_ms = timed(bfs_path_copying, obstacle, explored, frontier,
+                              start)
+    queue_len, queue_ms = timed(bfs_queue, obstacle, explored, frontier,
+                                start, dist)
+    wave_len, wave_ms = timed(bfs_wavefront, obstacle, explored, frontier,
+                              start, dist)
+    assert path_len == queue_len == wave_len
+    print("{:>6} {:>8} {:>10} {:>10.2f} {:>10.2f} {:>10.2f}".format(
+        'open', wave_len, size * size, path_ms, queue_ms, wave_ms))
+    print("total ms on the trajectory: path {:.1f}, queue {:.1f}, "
+          "wave {:.1f}".format(*totals))
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import env.utils.depth_utils as du
+
+
+def check_camera_projection(num_frames=40, seed=0):
+    rng = np.random.RandomState(seed)
+    for frame in range(num_frames):
+        width, height = rng.choice([64, 128, 256], 2)
+        fov = rng.uniform(60., 120.)
+        scale = rng.choice([1, 2, 4])
+        sensor_height = rng.uniform(50., 150.)
+        elevation = rng.uniform(-30., 30.)
+        camera_matrix = du.get_camera_matrix(width, height, fov)
+        projection = du.CameraProjection(camera_matrix, height, width, scale,
+                                         sensor_height, elevation)
+
+        depth = rng.rand(height, width) * 500 + 10
+        depth[rng.rand(height, width) < 0.05] = np.NaN
+        pose = [rng.rand() * 2560, rng.rand() * 2560,
+                (rng.rand() - 0.5) * 2 * np.pi]
+
+        expected = du.get_point_cloud_from_z(depth, camera_matrix, scale)
+        expected = du.transform_camera_view(expected, sensor_height, elevation)
+        expected = du.transform_pose(expected, pose)
+        result = du.transform_pose(projection.get_point_cloud(depth), pose)
+
+        assert result.shape == expected.shape, \
+            "shape differs at frame {}".format(frame)
+        assert np.array_equal(np.isnan(result), np.isnan(expected)), \
+            "invalid points differ at frame {}".format(frame)
+        assert np.allclose(result, expected, rtol=0, atol=1e-9,
+                           equal_nan=True), \
+            "points differ at frame {}".format(frame)
+
+
+if __name__ == "__main__":
+    check_camera_projection()
+    print("cached camera projection matches the point cloud transforms")
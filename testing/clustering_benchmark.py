@@ -0,0 +1,104 @@
+"""Benchmark of the frontier clustering algorithms.
+
+Compares the connected-component engine (CC) to AgglomerativeClustering
+(AGNES) on synthetic frontier sets of 1k-50k points, and on frontiers of
+maps built by MapBuilder along a random trajectory, e.g.
+
+    python testing/clustering_benchmark.py --sizes 1000,5000,50000
+
+AGNES needs quadratic memory, so it is skipped above --agnes_max_points.
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.ndimage.morphology import binary_dilation, binary_erosion
+from skimage import morphology
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from clustering import frontier_clustering, component_clustering, map_to_columns
+from sklearn.cluster import AgglomerativeClustering
+import mapping_benchmark as mb
+
+
+def make_frontier(num_points, rng):
+    """Returns a map whose frontier, the boundary of random explored
+    disks, has at least num_points cells."""
+    size = max(512, int(np.sqrt(num_points) * 12))
+    explored = np.zeros((size, size), dtype=bool)
+    rows, cols = np.ogrid[:size, :size]
+    frontier = explored
+    while frontier.sum() < num_points:
+        r, c = rng.randint(size, size=2)
+        radius = rng.randint(10, 60)
+        explored |= (rows - r) ** 2 + (cols - c) ** 2 <= radius ** 2
+        frontier = explored & ~binary_erosion(explored, border_value=1)
+    return frontier
+
+
+def real_frontiers(steps, rng):
+    """Frontier maps, as computed by get_frontier_map, every 10 steps of a
+    random trajectory through a procedural floorplan."""
+    walls = mb.make_floorplan(2560, rng)
+    camera_matrix = mb.du.get_camera_matrix(mb.FRAME_SIZE, mb.FRAME_SIZE,
+                                            mb.HFOV)
+    mapper = mb.build_mapper('incremental', 2560, 2, 64)
+    selem = morphology.disk(5)
+    frontiers = []
+    for i, pose in enumerate(mb.make_trajectory(walls, steps, rng)):
+        depth = mb.render_depth(walls, pose, camera_matrix)
+        _, map_gt, _, explored_gt, _, _, _ = mapper.update_map(depth, pose)
+        if i % 10 == 9:
+            contour = binary_dilation(explored_gt == 0, selem) & (explored_gt == 1)
+            contour = contour & (binary_dilation(map_gt, selem) == 0)
+            contour = morphology.remove_small_objects(contour, 2)
+            if contour.sum() >= 5:
+                frontiers.append(contour)
+    return frontiers
+
+
+def time_ms(fn, repeats):
+    times = []
+    for _ in range(repeats):
+        t = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t)
+    return 1000. * np.median(times)
+
+
+def report(name, frontier, args):
+    data = map_to_columns(frontier, frontier.shape[0])
+    cc = time_ms(lambda: component_clustering(data, 5), args.repeats)
+    cc_map = time_ms(lambda: frontier_clustering(frontier, 0, algo="CC"),
+                     args.repeats)
+    if len(data) <= args.agnes_max_points:
+        agnes = time_ms(lambda: AgglomerativeClustering(
+            n_clusters=5, linkage='ward').fit_predict(data), 1)
+        agnes = "{:10.2f}".format(agnes)
+    else:
+        agnes = "{:>10}".format("skipped")
+    print("{:>12} {:>8} {:10.3f} {:10.3f} {}".format(
+        name, len(data), cc, cc_map, agnes))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Frontier clustering benchmark')
+    parser.add_argument('--sizes', type=mb.parse_list,
+                        default=[1000, 2000, 5000, 10000, 20000, 50000])
+    parser.add_argument('--steps', type=int, default=200,
+                        help='trajectory length for the real map frontiers')
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--agnes_max_points', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = np.random.RandomState(args.seed)
+    print("{:>12} {:>8} {:>10} {:>10} {:>10}".format(
+        'frontier', 'points', 'CC ms', 'CC map ms', 'AGNES ms'))
+    for num_points in args.sizes:
+        report('synthetic', make_frontier(num_points, rng), args)
+    for i, frontier in enumerate(real_frontiers(args.steps, rng)):
+        report('real {}'.format(i), frontier, args)
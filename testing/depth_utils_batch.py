@@ -0,0 +1,37 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import env.utils.depth_utils as du
+
+
+def single_frame_bins(depth, pose, camera_matrix):
+    point_cloud = du.get_point_cloud_from_z(depth, camera_matrix, scale=2)
+    agent_view = du.transform_camera_view(point_cloud, 125, 0)
+    geocentric_pc = du.transform_pose(agent_view, pose)
+    return du.bin_points(geocentric_pc, 512, [25, 150], 5)
+
+
+def check_batch_equivalence(num_frames=8, seed=0):
+    rng = np.random.RandomState(seed)
+    camera_matrix = du.get_camera_matrix(256, 256, 90.0)
+
+    depth = rng.rand(num_frames, 256, 256) * 300 + 20
+    depth[rng.rand(num_frames, 256, 256) < 0.05] = np.NaN
+    poses = np.concatenate([rng.rand(num_frames, 2) * 2560,
+                            (rng.rand(num_frames, 1) - 0.5) * 2 * np.pi], 1)
+
+    expected = np.stack([single_frame_bins(depth[i].copy(), poses[i], camera_matrix)
+                         for i in range(num_frames)])
+    batched = du.get_binned_points_from_z_batch(depth, poses, camera_matrix, 2,
+                                                125, 0, 512, [25, 150], 5)
+
+    assert batched.shape == (num_frames, 512, 512, 3)
+    assert np.array_equal(batched, expected), "batched bins differ from single-frame bins"
+
+
+if __name__ == "__main__":
+    check_batch_equivalence()
+    print("batched projection matches the single-frame path")
@@ -0,0 +1,63 @@
+import os
+import sys
+
+import numpy as np
+from scipy.ndimage.morphology import binary_dilation
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from env.utils.fmm_planner import FMMDistanceCache, FMMPlanner
+
+
+def random_free_cell(traversible, rng):
+    rows, cols = np.nonzero(traversible)
+    i = rng.randint(len(rows))
+    return [int(rows[i]), int(cols[i])]
+
+
+def check_cache_equivalence(num_steps=80, size=100, seed=0):
+    rng = np.random.RandomState(seed)
+    obstacle = binary_dilation(rng.rand(size, size) < 0.02, np.ones((5, 5)))
+    visited = np.zeros((size, size), dtype=bool)
+    cache = FMMDistanceCache()
+    start = random_free_cell(~obstacle, rng)
+    goal = random_free_cell(~obstacle, rng)
+    key = 0
+
+    # Walks the agent along its short-term goals, marking the cells around
+    # it as visited and traversible as _get_gt_action does
+    for step in range(num_steps):
+        visited[max(0, start[0] - 2):start[0] + 3,
+                max(0, start[1] - 2):start[1] + 3] = True
+        traversible = ~obstacle | visited
+        traversible[max(0, start[0] - 1):start[0] + 2,
+                    max(0, start[1] - 1):start[1] + 2] = True
+        traversible[goal[0], goal[1]] = True
+        window = [start[0] - 2, start[0] + 3, start[1] - 2, start[1] + 3]
+
+        cached = FMMPlanner(traversible, 36, cache=cache, cache_key=key,
+                            changed_window=window)
+        fresh = FMMPlanner(traversible.copy(), 36)
+        assert np.array_equal(cached.set_goal([goal[1], goal[0]]),
+                              fresh.set_goal([goal[1], goal[0]])), \
+            "reachable cells differ at step {}".format(step)
+        assert np.array_equal(cached.fmm_dist, fresh.fmm_dist), \
+            "distances differ at step {}".format(step)
+        result = cached.get_short_term_goal(start)
+        expected = fresh.get_short_term_goal(start)
+        assert result[:3] == expected[:3], \
+            "short-term goals differ at step {}".format(step)
+
+        start = [int(result[0]), int(result[1])]
+        if rng.rand() < 0.1:
+            goal = random_free_cell(~obstacle, rng)
+        if rng.rand() < 0.05:
+            # A jump is only allowed with a new key, e.g. a new box
+            start = random_free_cell(~obstacle, rng)
+            key += 1
+
+    assert cache.version < num_steps, "the cached distances were never used"
+
+
+if __name__ == "__main__":
+    check_cache_equivalence()
+    print("cached FMM distances match freshly computed ones")
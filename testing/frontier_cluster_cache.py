@@ -0,0 +1,31 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from clustering import FrontierClusterCache, frontier_clustering
+
+
+def check_cluster_cache_equivalence(num_steps=30, size=60, seed=0):
+    rng = np.random.RandomState(seed)
+    cache = FrontierClusterCache("AGNES", recluster_threshold=0.)
+    frontier = np.zeros((size, size))
+    for step in range(num_steps):
+        # Flip a small box of frontier cells, or leave the frontier as it is
+        if rng.rand() < 0.8:
+            x, y = rng.randint(0, size - 5, 2)
+            frontier[x:x + rng.randint(1, 5), y:y + rng.randint(1, 5)] = \
+                1 - frontier[x, y]
+        if frontier.sum() < 5:
+            continue
+
+        result = cache.cluster(frontier).copy()
+        expected = frontier_clustering(frontier, step, algo="AGNES")
+        assert np.array_equal(result, expected), \
+            "cluster means differ at step {}".format(step)
+
+
+if __name__ == "__main__":
+    check_cluster_cache_equivalence()
+    print("cached frontier clusters match frontier_clustering")
@@ -0,0 +1,65 @@
+import os
+import sys
+
+import numpy as np
+from scipy import ndimage
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from env.utils.frontier import FrontierSegments
+
+
+def check_segments(segments, frontier, step):
+    expected, num = ndimage.label(frontier, np.ones((3, 3)))
+    # Same partition of the frontier cells as a full labelling
+    assert np.array_equal(segments.labels > 0, frontier), \
+        "frontier cells differ at step {}".format(step)
+    pairs = np.unique(np.stack([expected[frontier],
+                                segments.labels[frontier]]), axis=1)
+    assert pairs.shape[1] == num == len(segments.segments), \
+        "segments differ at step {}".format(step)
+
+    for i, segment in segments.segments.items():
+        rows, cols = np.nonzero(segments.labels == i)
+        assert segment['size'] == len(rows)
+        assert np.allclose(segment['centroid'], (rows.mean(), cols.mean()))
+        assert segment['bbox'] == [rows.min(), rows.max() + 1,
+                                   cols.min(), cols.max() + 1]
+
+
+def check_frontier_segments(num_steps=60, size=100, seed=0):
+    rng = np.random.RandomState(seed)
+    segments = FrontierSegments((size, size))
+    frontier = rng.rand(size, size) < 0.05
+    segments.update(frontier)
+    check_segments(segments, frontier, 0)
+
+    for step in range(1, num_steps):
+        labels = segments.labels.copy()
+        # Flip cells in a small box, the window of the update
+        x, y = rng.randint(0, size - 10, 2)
+        dx, dy = rng.randint(1, 10, 2)
+        frontier[x:x + dx, y:y + dy] = rng.rand(dx, dy) < rng.rand()
+        segments.update(frontier, [x, x + dx, y, y + dy])
+        check_segments(segments, frontier, step)
+
+        # Segments out of reach of the box keep their cells and IDs
+        near = np.zeros((size, size), dtype=bool)
+        near[max(0, x - 1):x + dx + 1, max(0, y - 1):y + dy + 1] = True
+        for i in np.unique(labels[labels > 0]):
+            cells = labels == i
+            if not near[cells].any():
+                assert np.array_equal(segments.labels == i, cells), \
+                    "segment {} changed at step {}".format(i, step)
+
+        # Nearest frontier cell, row-major first on ties
+        point = list(rng.randint(0, size, 2))
+        rows, cols = np.nonzero(frontier)
+        if len(rows) > 0:
+            i = np.argmin((rows - point[0]) ** 2 + (cols - point[1]) ** 2)
+            assert segments.nearest_cell(point) == [rows[i], cols[i]], \
+                "nearest cell differs at step {}".format(step)
+
+
+if __name__ == "__main__":
+    check_frontier_segments()
+    print("frontier segments match a full labelling of the frontier map")
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from env.utils.frontier import compute_frontier_map, make_frontier_tracker
+
+
+def check_tracker_equivalence(num_steps=50, size=120, seed=0):
+    rng = np.random.RandomState(seed)
+    obstacle = np.zeros((size, size))
+    explored = np.zeros((size, size))
+    visited = np.zeros((size, size))
+    bad_frontier_map = np.zeros((size, size))
+    tracker = make_frontier_tracker((size, size))
+
+    for step in range(num_steps):
+        # Explore a random box with a few obstacles and visited cells in it
+        x, y = rng.randint(0, size - 20, 2)
+        w, h = rng.randint(5, 30, 2)
+        explored[x:x + w, y:y + h] = 1
+        box = obstacle[x:x + w, y:y + h]
+        box[rng.rand(*box.shape) < 0.03] = 1
+        visited[rng.randint(size), rng.randint(size)] = 1
+        if step % 10 == 0:
+            bad_frontier_map[:] = 0
+            bad_frontier_map[rng.randint(size), rng.randint(size)] = 1
+
+        expected = compute_frontier_map(obstacle, explored, visited,
+                                        bad_frontier_map)
+        result = compute_frontier_map(obstacle, explored, visited,
+                                      bad_frontier_map, tracker)
+        assert np.array_equal(result > 0, expected), \
+            "tracked frontier differs at step {}".format(step)
+        rows, cols = tracker.get_points()
+        assert np.array_equal(rows, np.nonzero(expected)[0]) and \
+            np.array_equal(cols, np.nonzero(expected)[1])
+
+
+if __name__ == "__main__":
+    check_tracker_equivalence()
+    print("tracked frontier matches the full frontier")
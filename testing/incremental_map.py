@@ -0,0 +1,44 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from env.utils.map_builder import MapBuilder
+
+
+def build_mapper(incremental_map):
+    params = dict(frame_width=256, frame_height=256, fov=90., resolution=5,
+                  map_size_cm=2560, agent_min_z=25, agent_max_z=150,
+                  agent_height=125, agent_view_angle=0, du_scale=2,
+                  vision_range=64, visualize=0, obs_threshold=1, num_maps=5,
+                  incremental_map=incremental_map, log_odds_map=0,
+                  clustering_algo='AGNES',
+                  recluster_threshold=0., async_clustering=0,
+                  clustering_workers=1)
+    return MapBuilder(params)
+
+
+def check_incremental_equivalence(num_steps=40, seed=0):
+    rng = np.random.RandomState(seed)
+    full, incremental = build_mapper(0), build_mapper(1)
+
+    pose = np.array([1280., 1280., 0.])
+    for step in range(num_steps):
+        depth = rng.rand(256, 256) * 400 + 20
+        depth[rng.rand(256, 256) < 0.05] = np.NaN
+        pose += [rng.randn() * 20, rng.randn() * 20, rng.randn() * 0.5]
+
+        expected = full.update_map(depth.copy(), pose.copy())
+        result = incremental.update_map(depth.copy(), pose.copy())
+        for name, a, b in zip(['fp_proj', 'map', 'fp_explored', 'explored',
+                               'new_explored', 'frontier', 'clusters'],
+                              expected, result):
+            assert np.array_equal(np.asarray(a, dtype=float),
+                                  np.asarray(b, dtype=float)), \
+                "{} differs at step {}".format(name, step)
+
+
+if __name__ == "__main__":
+    check_incremental_equivalence()
+    print("incremental map updates match full map updates")
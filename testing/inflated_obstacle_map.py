@@ -0,0 +1,40 @@
+import os
+import sys
+
+import numpy as np
+import skimage.morphology
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from env.utils.obstacle_map import InflatedObstacleMap
+
+
+def check_inflated_equivalence(num_steps=50, size=100, seed=0):
+    rng = np.random.RandomState(seed)
+    for selem in [skimage.morphology.disk(3), skimage.morphology.square(4)]:
+        inflated = InflatedObstacleMap(selem)
+        obstacle = rng.rand(size, size) < 0.02
+        for step in range(num_steps):
+            version, previous = inflated.version, obstacle.copy()
+            # Add and remove obstacles in a small box, or change nothing
+            window = None
+            if rng.rand() < 0.8:
+                x, y = rng.randint(0, size - 8, 2)
+                dx, dy = rng.randint(1, 8, 2)
+                obstacle[x:x + dx, y:y + dy] = \
+                    rng.rand(dx, dy) < rng.rand()
+                if rng.rand() < 0.5:
+                    window = [x, x + dx, y, y + dy]
+
+            result = inflated.update(obstacle.astype(float), window)
+            expected = skimage.morphology.binary_dilation(obstacle, selem)
+            assert np.array_equal(result, expected), \
+                "inflated map differs at step {}".format(step)
+            if step > 0 and window is None and \
+                    np.array_equal(obstacle, previous):
+                assert inflated.version == version, \
+                    "version changed without a change at step {}".format(step)
+
+
+if __name__ == "__main__":
+    check_inflated_equivalence()
+    print("inflated obstacle map matches the full dilation")
@@ -0,0 +1,118 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import env.utils.depth_utils as du
+from env.utils.map_builder import MapBuilder, LOG_ODDS_HIT, LOG_ODDS_MISS, \
+    LOG_ODDS_MIN, LOG_ODDS_MAX
+
+
+def build_mapper(log_odds_map):
+    params = dict(frame_width=256, frame_height=256, fov=90., resolution=5,
+                  map_size_cm=2560, agent_min_z=25, agent_max_z=150,
+                  agent_height=125, agent_view_angle=0, du_scale=2,
+                  vision_range=64, visualize=0, obs_threshold=1, num_maps=5,
+                  incremental_map=1, log_odds_map=log_odds_map,
+                  clustering_algo='AGNES',
+                  recluster_threshold=0., async_clustering=0,
+                  clustering_workers=1)
+    return MapBuilder(params)
+
+
+def get_evidence(mapper, depth, pose):
+    # Cells hit by points in the obstacle z range and cells crossed by the
+    # free-space rays of one frame, over the whole map
+    size = mapper.map.shape[0]
+    with np.errstate(invalid="ignore"):
+        depth[depth > mapper.vision_range * mapper.resolution] = np.NaN
+    point_cloud = mapper.camera_projection.get_point_cloud(depth)
+    geocentric = du.transform_pose(point_cloud, pose)
+    counts = du.bin_points(geocentric, size, mapper.z_bins, mapper.resolution)
+    hit = counts[:, :, 1] / mapper.obs_threshold >= 0.5
+
+    xs, ys = du.get_free_space_points(
+        geocentric, pose[:2], mapper.z_bins,
+        mapper.vision_range * mapper.resolution, mapper.resolution / 2.)
+    cols = np.round(xs / mapper.resolution).astype(int)
+    rows = np.round(ys / mapper.resolution).astype(int)
+    valid = (rows >= 0) & (rows < size) & (cols >= 0) & (cols < size)
+    free = np.zeros((size, size), dtype=bool)
+    free[rows[valid], cols[valid]] = True
+    return hit, free, counts.sum(2) > 0
+
+
+def get_view(occupied, mapper, pose):
+    # occupied read at the centres of the egocentric projection cells,
+    # rotated and shifted into the map by hand
+    vision_range, resolution = mapper.vision_range, mapper.resolution
+    rows, cols = np.mgrid[0:vision_range, 0:vision_range]
+    x = cols * resolution - vision_range * resolution // 2
+    y = rows * resolution
+    theta = pose[2] - np.pi / 2.
+    gx = x * np.cos(theta) - y * np.sin(theta) + pose[0]
+    gy = x * np.sin(theta) + y * np.cos(theta) + pose[1]
+    gc = np.round(gx / resolution).astype(int)
+    gr = np.round(gy / resolution).astype(int)
+    size = occupied.shape[0]
+    valid = (gr >= 0) & (gr < size) & (gc >= 0) & (gc < size)
+    view = np.zeros((vision_range, vision_range))
+    view[valid] = occupied[gr[valid], gc[valid]]
+    return view
+
+
+def check_fixed_point():
+    # The int8 steps are the log-odds of the sensor model in units of 0.1
+    assert LOG_ODDS_HIT == int(round(10 * np.log(0.7 / 0.3)))
+    assert LOG_ODDS_MISS == int(round(10 * np.log(0.4 / 0.6)))
+    assert -128 <= LOG_ODDS_MIN + LOG_ODDS_MISS and \
+        LOG_ODDS_MAX + LOG_ODDS_HIT <= 127
+
+
+def check_log_odds_reference(num_steps=60, seed=0):
+    rng = np.random.RandomState(seed)
+    mapper, thresholded = build_mapper(1), build_mapper(0)
+    size = mapper.map.shape[0]
+    log_odds = np.zeros((size, size))
+    explored = np.zeros((size, size), dtype=bool)
+
+    pose = np.array([1280., 1280., 0.])
+    for step in range(num_steps):
+        depth = rng.rand(256, 256) * 400 + 20
+        depth[rng.rand(256, 256) < 0.05] = np.NaN
+        # Small moves, so that cells are seen often enough to be clamped
+        pose += [rng.randn() * 5, rng.randn() * 5, rng.randn() * 0.2]
+
+        hit, free, seen = get_evidence(mapper, depth.copy(), pose.copy())
+        log_odds += 0.1 * LOG_ODDS_HIT * hit + \
+            0.1 * LOG_ODDS_MISS * (free & ~hit)
+        log_odds = np.clip(log_odds, 0.1 * LOG_ODDS_MIN, 0.1 * LOG_ODDS_MAX)
+        explored |= seen | free
+
+        fp_proj, map_gt, fp_explored, explored_gt, _, _, _ = \
+            mapper.update_map(depth.copy(), pose.copy())
+        expected_fp_explored = thresholded.update_map(
+            depth.copy(), pose.copy())[2]
+
+        assert np.allclose(0.1 * mapper.log_odds, log_odds), \
+            "log-odds differ at step {}".format(step)
+        assert np.array_equal(map_gt, log_odds > 1e-9), \
+            "map_gt differs at step {}".format(step)
+        assert np.array_equal(explored_gt, explored), \
+            "explored_gt differs at step {}".format(step)
+        assert np.array_equal(fp_explored, expected_fp_explored), \
+            "fp_explored differs at step {}".format(step)
+        assert np.array_equal(
+            fp_proj, get_view(log_odds > 1e-9, mapper, pose) * fp_explored), \
+            "fp_proj differs at step {}".format(step)
+
+    # Both bounds were reached
+    assert np.isclose(log_odds.max(), 0.1 * LOG_ODDS_MAX) and \
+        np.isclose(log_odds.min(), 0.1 * LOG_ODDS_MIN)
+
+
+if __name__ == "__main__":
+    check_fixed_point()
+    check_log_odds_reference()
+    print("log-odds map updates match the float reference")
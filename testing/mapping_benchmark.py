@@ -0,0 +1,213 @@
+"""Micro-benchmarks for the mapping stack, without Habitat.
+
+Depth frames are ray cast from procedural floorplans along a random
+trajectory and fed to MapBuilder for every combination of backend, map
+size, du_scale and vision range. Per-stage latency percentiles and peak
+allocations are reported, e.g.
+
+    python testing/mapping_benchmark.py --steps 200 --map_sizes 2560,5120
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+from scipy.ndimage.morphology import binary_dilation
+from skimage import morphology
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import env.utils.depth_utils as du
+from env.utils.map_builder import MapBuilder
+from clustering import frontier_clustering
+
+BACKENDS = {
+    'full': dict(incremental_map=0, log_odds_map=0),
+    'incremental': dict(incremental_map=1, log_odds_map=0),
+    'log_odds': dict(incremental_map=1, log_odds_map=1),
+}
+
+FRAME_SIZE = 256
+HFOV = 90.
+CAMERA_HEIGHT = 125.
+WALL_HEIGHT = 300.
+CELL_CM = 5.
+
+
+def make_floorplan(size_cm, rng, room_cm=400):
+    """Returns a boolean wall grid of CELL_CM cells: outer walls and a grid
+    of rooms whose walls each have a doorway at a random position."""
+    size = int(size_cm // CELL_CM)
+    room = int(room_cm // CELL_CM)
+    door = int(100 // CELL_CM)
+    walls = np.zeros((size, size), dtype=bool)
+    walls[:2, :] = walls[-2:, :] = walls[:, :2] = walls[:, -2:] = True
+    for start in range(room, size - 2, room):
+        walls[start:start + 2, :] = True
+        walls[:, start:start + 2] = True
+    for start in range(room, size - 2, room):
+        for end in range(0, size, room):
+            d = end + rng.randint(2, max(3, room - door - 2))
+            walls[start:start + 2, d:d + door] = False
+            walls[d:d + door, start:start + 2] = False
+    return walls
+
+
+def render_depth(walls, pose, camera_matrix, max_depth_cm=1000.):
+    """Ray casts a depth frame in cm (forward distance, as habitat gives it)
+    from pose (x cm, y cm, theta radians) into the floorplan."""
+    cols = np.arange(FRAME_SIZE)
+    u = (cols - camera_matrix.xc) / camera_matrix.f
+    bearing = pose[2] - np.arctan(u)
+    r = np.arange(0., max_depth_cm, CELL_CM / 2.)
+    xs = pose[0] + np.cos(bearing)[:, np.newaxis] * r
+    ys = pose[1] + np.sin(bearing)[:, np.newaxis] * r
+    ix = np.clip((xs / CELL_CM).astype(int), 0, walls.shape[1] - 1)
+    iy = np.clip((ys / CELL_CM).astype(int), 0, walls.shape[0] - 1)
+    hit = walls[iy, ix]
+    wall_range = np.where(hit.any(1), r[np.argmax(hit, 1)], max_depth_cm)
+    wall_depth = wall_range / np.sqrt(1. + u ** 2)
+
+    rows = np.arange(FRAME_SIZE)
+    v = (camera_matrix.zc - rows) / camera_matrix.f
+    with np.errstate(divide='ignore'):
+        plane_depth = np.where(v > 0, (WALL_HEIGHT - CAMERA_HEIGHT) / v,
+                               -CAMERA_HEIGHT / v)
+    depth = np.minimum(plane_depth[:, np.newaxis], wall_depth[np.newaxis, :])
+    return np.minimum(depth, max_depth_cm).astype(np.float32)
+
+
+def make_trajectory(walls, steps, rng):
+    """A random walk of forward 25 cm and 10 degree turns that avoids walls."""
+    free = np.argwhere(~walls)
+    y, x = free[rng.randint(len(free))]
+    pose = np.array([x * CELL_CM, y * CELL_CM, 0.])
+    poses = []
+    for _ in range(steps):
+        action = rng.choice(3, p=[0.2, 0.2, 0.6])
+        if action == 2:
+            nxt = pose + [25. * np.cos(pose[2]), 25. * np.sin(pose[2]), 0.]
+            cy, cx = int(nxt[1] // CELL_CM), int(nxt[0] // CELL_CM)
+            if not walls[max(0, cy - 4):cy + 5, max(0, cx - 4):cx + 5].any():
+                pose = nxt
+            else:
+                pose[2] += np.deg2rad(10.)
+        else:
+            pose[2] += np.deg2rad(10. if action == 0 else -10.)
+        poses.append(pose.copy())
+    return poses
+
+
+def build_mapper(backend, map_size_cm, du_scale, vision_range):
+    params = dict(frame_width=FRAME_SIZE, frame_height=FRAME_SIZE, fov=HFOV,
+                  resolution=int(CELL_CM), map_size_cm=map_size_cm,
+                  agent_min_z=25, agent_max_z=150, agent_height=CAMERA_HEIGHT,
+                  agent_view_angle=0, du_scale=du_scale,
+                  vision_range=vision_range, visualize=0, obs_threshold=1,
+                  num_maps=5, clustering_algo='CC',
+                  recluster_threshold=0.1, async_clustering=0,
+                  clustering_workers=1)
+    params.update(BACKENDS[backend])
+    return MapBuilder(params)
+
+
+def run_stages(mapper, depth, pose):
+    """Runs one step stage by stage and returns {stage: seconds}."""
+    times = {}
+
+    t = time.perf_counter()
+    point_cloud = mapper.camera_projection.get_point_cloud(depth)
+    times['project'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    geocentric_pc = du.transform_pose(point_cloud, pose)
+    du.bin_points_window(geocentric_pc, mapper.map.shape[0], mapper.z_bins,
+                         mapper.resolution)
+    times['bin'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    outputs = mapper.update_map(depth, pose)
+    times['update_map'] = time.perf_counter() - t
+    return times, outputs
+
+
+def time_frontier(mapper, explored_gt, map_gt):
+    # Full-map frontier extraction, as done by the non-incremental mapper.
+    t = time.perf_counter()
+    explored_gt, map_gt = np.asarray(explored_gt), np.asarray(map_gt)
+    contour = binary_dilation(explored_gt == 0, mapper.frontier_kernel) & \
+        (explored_gt == 1)
+    contour = contour & (binary_dilation(map_gt, mapper.frontier_kernel) == 0)
+    contour = morphology.remove_small_objects(contour, 2)
+    return time.perf_counter() - t, contour
+
+
+def peak_allocation(fn):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def benchmark(args, backend, map_size_cm, du_scale, vision_range, rng):
+    walls = make_floorplan(map_size_cm, rng)
+    camera_matrix = du.get_camera_matrix(FRAME_SIZE, FRAME_SIZE, HFOV)
+    poses = make_trajectory(walls, args.steps, rng)
+    frames = [render_depth(walls, pose, camera_matrix) for pose in poses]
+
+    mapper = build_mapper(backend, map_size_cm, du_scale, vision_range)
+    stage_times = {}
+    outputs = None
+    for i, (depth, pose) in enumerate(zip(frames, poses)):
+        times, outputs = run_stages(mapper, depth.copy(), pose)
+        if i % args.frontier_every == 0:
+            times['frontier'], contour = time_frontier(mapper, outputs[3], outputs[1])
+            if args.cluster and contour.sum() >= 5:
+                t = time.perf_counter()
+                frontier_clustering(contour, step=0, algo=args.clustering)
+                times['clustering'] = time.perf_counter() - t
+        for stage, seconds in times.items():
+            stage_times.setdefault(stage, []).append(seconds)
+
+    peak = peak_allocation(lambda: mapper.update_map(frames[-1].copy(), poses[-1]))
+
+    name = "{} map={}cm du_scale={} vision_range={}".format(
+        backend, map_size_cm, du_scale, vision_range)
+    print(name)
+    for stage, seconds in stage_times.items():
+        p50, p90, p99 = np.percentile(np.array(seconds) * 1000, [50, 90, 99])
+        print("    {:<12} p50 {:8.3f} ms  p90 {:8.3f} ms  p99 {:8.3f} ms".format(
+            stage, p50, p90, p99))
+    print("    update_map peak allocation {:.1f} KB, map storage {:.1f} KB".format(
+        peak / 1024., mapper.map.nbytes / 1024.))
+
+
+def parse_list(value, cast=int):
+    return [cast(v) for v in value.split(',')]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Mapping micro-benchmarks')
+    parser.add_argument('--steps', type=int, default=100)
+    parser.add_argument('--backends', type=lambda v: parse_list(v, str),
+                        default=list(BACKENDS))
+    parser.add_argument('--map_sizes', type=parse_list, default=[2560, 5120])
+    parser.add_argument('--du_scales', type=parse_list, default=[1, 2])
+    parser.add_argument('--vision_ranges', type=parse_list, default=[64])
+    parser.add_argument('--frontier_every', type=int, default=10,
+                        help='time full-map frontier extraction every k steps')
+    parser.add_argument('--cluster', type=int, default=0,
+                        help='1: also time frontier_clustering on the frontier')
+    parser.add_argument('--clustering', type=str, default='CC',
+                        help='frontier_clustering algo: CC | AGNES')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    for backend, map_size_cm, du_scale, vision_range in itertools.product(
+            args.backends, args.map_sizes, args.du_scales, args.vision_ranges):
+        benchmark(args, backend, map_size_cm, du_scale, vision_range,
+                  np.random.RandomState(args.seed))
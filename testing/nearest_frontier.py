@@ -0,0 +1,83 @@
+import ast
+import os
+import sys
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+from env.utils.frontier import NearestFrontierIndex
+
+
+def nearest_cells(frontier, point, k=1, exclude=None):
+    # argmin of the squared distance over the frontier cells
+    rows, cols = np.nonzero(frontier)
+    if exclude is not None:
+        keep = exclude[rows, cols] == 0
+        rows, cols = rows[keep], cols[keep]
+    dist = (rows - point[0]) ** 2 + (cols - point[1]) ** 2
+    order = np.lexsort((rows * frontier.shape[1] + cols, dist))[:k]
+    return [[r, c] for r, c in zip(rows[order], cols[order])]
+
+
+def check_nearest_frontier(num_steps=30, num_maps=3, size=80, seed=0):
+    rng = np.random.RandomState(seed)
+    index = NearestFrontierIndex(num_maps, (size, size))
+    frontiers = [np.zeros((size, size), dtype=bool) for _ in range(num_maps)]
+    for step in range(num_steps):
+        for m in range(num_maps):
+            # Sparse, dense and empty frontiers
+            density = rng.choice([0., 0.001, 0.01, 0.2])
+            frontiers[m] = rng.rand(size, size) < density
+            index.update(m, np.nonzero(frontiers[m]))
+        points = [list(rng.randint(0, size, 2)) for _ in range(num_maps)]
+        excludes = [rng.rand(size, size) < 0.5 for _ in range(num_maps)]
+
+        for m in range(num_maps):
+            for k in [1, 3]:
+                for exclude in [None, excludes[m]]:
+                    result = [list(c) for c in index.query(
+                        m, points[m], k=k, exclude=exclude)]
+                    expected = nearest_cells(frontiers[m], points[m], k,
+                                             exclude)
+                    assert result == expected, \
+                        "map {} differs at step {}".format(m, step)
+
+        expected = [nearest_cells(frontiers[m], points[m], 1, excludes[m])
+                    for m in range(num_maps)]
+        result = index.query_batch(points, exclude=excludes)
+        assert [[list(c)] if c is not None else [] for c in result] == \
+            expected, "batch query differs at step {}".format(step)
+
+
+# Drivers that snap the policy's goals to the frontier
+SNAPPING_DRIVERS = ['main.py', 'main_clustering.py', 'main_to_local.py',
+                    'Local_explore_fixing.py', 'test_rot_only_once.py',
+                    'test_rot_per_k_steps.py', 'test_rot_random.py']
+# Drivers with a frontier map but no goal snapping
+FRONTIER_DRIVERS = SNAPPING_DRIVERS + ['local_sweep_policy.py']
+
+
+def check_drivers():
+    for name in FRONTIER_DRIVERS:
+        with open(os.path.join(ROOT, name)) as f:
+            tree = ast.parse(f.read())
+        calls = [node for node in ast.walk(tree) if isinstance(node, ast.Call)]
+        names = set(ast.unparse(call.func) for call in calls)
+        # The frontier cells come from the tracker or the index, not from a
+        # scan of the whole frontier map
+        assert not any(ast.unparse(call.func) == 'np.nonzero' and
+                       ast.unparse(call.args[0]) == 'frontier_map'
+                       for call in calls), \
+            "{} scans the frontier map".format(name)
+        if name in SNAPPING_DRIVERS:
+            assert 'NearestFrontierIndex' in names and \
+                'frontier_index.query_batch' in names and \
+                'frontier_index.update' in names, \
+                "{} does not snap through the index".format(name)
+
+
+if __name__ == "__main__":
+    check_nearest_frontier()
+    check_drivers()
+    print("nearest frontier queries match the argmin over frontier cells")
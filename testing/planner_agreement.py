@@ -0,0 +1,86 @@
+import math
+import os
+import sys
+
+import numpy as np
+from scipy.ndimage.morphology import binary_dilation
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from env.utils.fmm_planner import FMMPlanner
+from env.utils.planners import AStarPlanner, MultiResolutionPlanner
+
+
+def make_map(size, rng):
+    """Traversible map of random walls and blocks, inflated by a cell."""
+    obstacle = np.zeros((size, size), dtype=bool)
+    for _ in range(25):
+        r, c = rng.randint(0, size, 2)
+        if rng.rand() < 0.5:
+            obstacle[r:r + rng.randint(1, 20), c:c + rng.randint(1, 20)] = True
+        elif rng.rand() < 0.5:
+            obstacle[r:r + 2, c:c + rng.randint(10, 60)] = True
+        else:
+            obstacle[r:r + rng.randint(10, 60), c:c + 2] = True
+    return ~binary_dilation(obstacle, np.ones((3, 3)))
+
+
+def roll_out(planner_class, traversible, start, goal, max_steps=300):
+    """Reachable mask of set_goal, first short-term goal, goal reached and
+    path length of the roll-out of the short-term goals."""
+    planner = planner_class(traversible.copy(), 36)
+    reachable = planner.set_goal([goal[1], goal[0]])
+    state, length = [float(start[0]), float(start[1])], 0.
+    stg_x, stg_y, replan, _ = planner.get_short_term_goal(state)
+    first = (stg_x, stg_y)
+    for _ in range(max_steps):
+        if (state[0] - goal[0]) ** 2 + (state[1] - goal[1]) ** 2 < 4 ** 2:
+            return reachable, first, True, length
+        if replan:
+            break
+        length += math.hypot(stg_x - state[0], stg_y - state[1])
+        state = [stg_x, stg_y]
+        stg_x, stg_y, replan, _ = planner.get_short_term_goal(state)
+    return reachable, first, False, length
+
+
+def check_planner_agreement(num_maps=6, problems_per_map=15, size=120,
+                            seed=0):
+    rng = np.random.RandomState(seed)
+    headings = []
+    for m in range(num_maps):
+        traversible = make_map(size, rng)
+        free = np.argwhere(traversible)
+        for _ in range(problems_per_map):
+            start = free[rng.randint(len(free))]
+            goal = free[rng.randint(len(free))]
+            expected = roll_out(FMMPlanner, traversible, start, goal)
+            for planner_class in [AStarPlanner, MultiResolutionPlanner]:
+                name = planner_class.__name__
+                result = roll_out(planner_class, traversible, start, goal)
+                assert np.array_equal(result[0], expected[0]), \
+                    "{} reachable cells differ on map {}".format(name, m)
+                if not expected[2]:
+                    continue
+                assert result[2], "{} does not reach the goal".format(name)
+                assert result[3] <= 1.25 * expected[3] + 5, \
+                    "{} path is too long".format(name)
+                # Heading of the first short-term goal from the start cell
+                angles = [math.atan2(stg[0] - start[0] - 0.5,
+                                     stg[1] - start[1] - 0.5)
+                          for stg in [expected[1], result[1]]]
+                headings.append(abs((math.degrees(angles[0] - angles[1]) +
+                                     180) % 360 - 180))
+    assert np.mean(np.array(headings) <= 45) >= 0.9, \
+        "first short-term goals disagree with FMM"
+
+    # At the goal there is nothing to replan
+    traversible = np.ones((20, 20), dtype=bool)
+    for planner_class in [AStarPlanner, MultiResolutionPlanner]:
+        planner = planner_class(traversible, 36)
+        planner.set_goal([10, 10])
+        assert not planner.get_short_term_goal([10., 10.])[2]
+
+
+if __name__ == "__main__":
+    check_planner_agreement()
+    print("A* and multi-resolution planners agree with FMM")
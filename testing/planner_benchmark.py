@@ -0,0 +1,132 @@
+"""Benchmark of the planner backends of Exploration_Env._get_gt_action.
+
+Planning problems, a traversible map with a start, a goal and the agent
+orientation, are recorded from procedural floorplans along a random
+trajectory (--record problems.npz), or replayed from a previous recording
+(--replay problems.npz). Every backend plans every problem and reports
+the latency of the first plan, the rate of goals reached and the path
+length of a roll-out following its short-term goals, and how often its
+first action agrees with the FMM planner, e.g.
+
+    python testing/planner_benchmark.py --record /tmp/problems.npz
+    python testing/planner_benchmark.py --replay /tmp/problems.npz
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+from scipy.ndimage.morphology import binary_dilation
+from skimage import morphology
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from env.utils.planners import PLANNERS
+import mapping_benchmark as mb
+
+
+def record_problems(args, rng):
+    """maps (num_maps, h, w) traversible maps and problems rows of map
+    index, start row, start col, goal row, goal col, orientation (deg)."""
+    maps, problems = [], []
+    for m in range(args.num_maps):
+        walls = mb.make_floorplan(args.map_size_cm, rng)
+        traversible = ~binary_dilation(walls, morphology.disk(1))
+        maps.append(traversible)
+        for pose in mb.make_trajectory(walls, args.problems_per_map, rng):
+            start = [int(pose[1] // mb.CELL_CM), int(pose[0] // mb.CELL_CM)]
+            for _ in range(100):
+                goal = [start[0] + rng.randint(-args.goal_range, args.goal_range + 1),
+                        start[1] + rng.randint(-args.goal_range, args.goal_range + 1)]
+                if 0 <= goal[0] < walls.shape[0] and \
+                        0 <= goal[1] < walls.shape[1] and \
+                        traversible[goal[0], goal[1]]:
+                    break
+            problems.append([m] + start + goal + [int(np.rad2deg(pose[2]))])
+    return np.array(maps), np.array(problems)
+
+
+def get_action(start, stg, start_o):
+    """The action of _get_gt_action towards the short-term goal."""
+    angle_st_goal = math.degrees(math.atan2(stg[0] - start[0],
+                                            stg[1] - start[1]))
+    angle_agent = start_o % 360.0
+    if angle_agent > 180:
+        angle_agent -= 360
+    relative_angle = (angle_agent - angle_st_goal) % 360.0
+    if relative_angle > 180:
+        relative_angle -= 360
+    if relative_angle > 15.:
+        return 1
+    elif relative_angle < -15.:
+        return 0
+    return 2
+
+
+def solve(planner_class, traversible, start, goal, start_o, max_steps):
+    """First plan latency in ms, first action, goal reached and path length
+    of the roll-out of the short-term goals."""
+    t = time.time()
+    planner = planner_class(traversible.copy(), 36)
+    planner.set_goal([goal[1], goal[0]])
+    stg_x, stg_y, replan, _ = planner.get_short_term_goal(list(start))
+    latency = (time.time() - t) * 1000.
+    action = get_action(start, (stg_x, stg_y), start_o)
+
+    state, length = [float(start[0]), float(start[1])], 0.
+    for _ in range(max_steps):
+        if (state[0] - goal[0]) ** 2 + (state[1] - goal[1]) ** 2 < 4 ** 2:
+            return latency, action, True, length
+        if replan:
+            break
+        length += math.hypot(stg_x - state[0], stg_y - state[1])
+        state = [stg_x, stg_y]
+        stg_x, stg_y, replan, _ = planner.get_short_term_goal(state)
+    return latency, action, False, length
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Planner backend benchmark')
+    parser.add_argument('--record', type=str, default="",
+                        help='save the generated problems to this .npz')
+    parser.add_argument('--replay', type=str, default="",
+                        help='replay the problems of this .npz')
+    parser.add_argument('--planners', type=lambda s: s.split(','),
+                        default=sorted(PLANNERS))
+    parser.add_argument('--map_size_cm', type=int, default=2400)
+    parser.add_argument('--num_maps', type=int, default=2)
+    parser.add_argument('--problems_per_map', type=int, default=20)
+    parser.add_argument('--goal_range', type=int, default=80,
+                        help='largest start to goal offset, in cells')
+    parser.add_argument('--max_steps', type=int, default=200)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.replay:
+        data = np.load(args.replay)
+        maps, problems = data['maps'], data['problems']
+    else:
+        maps, problems = record_problems(args, np.random.RandomState(args.seed))
+        if args.record:
+            np.savez_compressed(args.record, maps=maps, problems=problems)
+
+    results = {}
+    for name in args.planners:
+        results[name] = [solve(PLANNERS[name], maps[m], (sr, sc), (gr, gc),
+                               o, args.max_steps)
+                         for m, sr, sc, gr, gc, o in problems]
+
+    reference = results.get('fmm')
+    print("{:>10} {:>10} {:>10} {:>10} {:>12} {:>10}".format(
+        'planner', 'mean ms', 'p95 ms', 'reached', 'path length',
+        'agreement'))
+    for name in args.planners:
+        latency, action, reached, length = zip(*results[name])
+        agreement = np.nan if reference is None else \
+            np.mean([a == r[1] for a, r in zip(action, reference)])
+        print("{:>10} {:>10.2f} {:>10.2f} {:>10.2f} {:>12.1f} {:>10.2f}".format(
+            name, np.mean(latency), np.percentile(latency, 95),
+            np.mean(reached), np.mean(np.array(length)[list(reached)])
+            if any(reached) else np.nan, agreement))
@@ -0,0 +1,53 @@
+import collections
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from env.utils.fmm_planner import get_reachable_goal
+
+
+def component(traversible, start):
+    """Cells 4-connected to start, by breadth-first search."""
+    h, w = traversible.shape
+    seen = np.zeros((h, w), dtype=bool)
+    seen[start[0], start[1]] = True
+    queue = collections.deque([tuple(start)])
+    while queue:
+        r, c = queue.popleft()
+        for nr, nc in ((r - 1, c), (r + 1, c), (r, c - 1), (r, c + 1)):
+            if 0 <= nr < h and 0 <= nc < w and traversible[nr, nc] and \
+                    not seen[nr, nc]:
+                seen[nr, nc] = True
+                queue.append((nr, nc))
+    return seen
+
+
+def check_reachable_goal(num_problems=300, size=40, seed=0):
+    rng = np.random.RandomState(seed)
+    for problem in range(num_problems):
+        traversible = rng.rand(size, size) < rng.uniform(0.4, 0.8)
+        start = list(rng.randint(0, size, 2))
+        traversible[start[0], start[1]] = True
+        goal = list(rng.randint(0, size, 2))
+
+        with_goal = traversible.copy()
+        with_goal[goal[0], goal[1]] = True
+        reachable = component(with_goal, start)
+        if reachable[goal[0], goal[1]]:
+            expected = goal
+        else:
+            # Nearest cell of the start's component, row-major on ties
+            rows, cols = np.nonzero(reachable)
+            i = np.argmin((rows - goal[0]) ** 2 + (cols - goal[1]) ** 2)
+            expected = [rows[i], cols[i]]
+
+        result = get_reachable_goal(traversible, start, goal)
+        assert list(result) == list(expected), \
+            "goal differs for problem {}".format(problem)
+
+
+if __name__ == "__main__":
+    check_reachable_goal()
+    print("reachable goals match the breadth-first search")
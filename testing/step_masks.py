@@ -0,0 +1,44 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from env.utils.fmm_planner import MASK_RESOLUTION, get_dist, get_mask, \
+    get_step_masks, get_window
+
+
+def check_step_masks(num_offsets=100, seed=0):
+    rng = np.random.RandomState(seed)
+    for scale, step_size in [(1, 5), (1, 10), (2, 5)]:
+        # Offsets on the lookup table grid and off it
+        offsets = list(rng.randint(0, MASK_RESOLUTION, (num_offsets, 2)) /
+                       MASK_RESOLUTION) + list(rng.rand(num_offsets, 2))
+        for sx, sy in offsets:
+            mask, dist = get_step_masks(sx, sy, scale, step_size)
+            assert np.array_equal(mask, get_mask(sx, sy, scale, step_size)), \
+                "step mask differs at offset {}".format((sx, sy))
+            assert np.array_equal(dist, get_dist(sx, sy, scale, step_size)), \
+                "distance mask differs at offset {}".format((sx, sy))
+
+
+def check_windows(num_windows=200, seed=0):
+    rng = np.random.RandomState(seed)
+    for _ in range(num_windows):
+        array = rng.rand(*rng.randint(1, 40, 2))
+        radius = rng.randint(0, 8)
+        # Centres inside the array and on its border
+        x = rng.randint(0, array.shape[0])
+        y = rng.randint(0, array.shape[1])
+        fill = rng.choice([0., 1e4])
+        padded = np.pad(array, radius, 'constant', constant_values=fill)
+        expected = padded[x:x + 2 * radius + 1, y:y + 2 * radius + 1]
+        result = get_window(array, x, y, radius, fill)
+        assert np.array_equal(result, expected), \
+            "window differs at {} radius {}".format((x, y), radius)
+
+
+if __name__ == "__main__":
+    check_step_masks()
+    check_windows()
+    print("step masks and windows match the padded computation")